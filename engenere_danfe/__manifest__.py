@@ -11,7 +11,13 @@
     "website": "https://engenere.one",
     "depends": [
         "l10n_br_account",
+        "l10n_br_nfe",
+    ],
+    "data": [
+        "security/ir.model.access.csv",
+        "data/ir_cron.xml",
+        "reports/danfe_report.xml",
+        "wizards/danfe_export_wizard.xml",
     ],
-    "data": ["reports/danfe_report.xml"],
     "demo": [],
 }
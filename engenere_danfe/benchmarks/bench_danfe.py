@@ -0,0 +1,164 @@
+# Copyright 2023 Engenere.one
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+"""Benchmark da geração do DANFE, sem banco de dados e sem o odoo.
+
+Uso::
+
+    python engenere_danfe/benchmarks/bench_danfe.py
+    python engenere_danfe/benchmarks/bench_danfe.py --save
+    python engenere_danfe/benchmarks/bench_danfe.py --compare --tolerance 0.25
+
+Para cada fixture mede o tempo de Danfe(...) + writeto_pdf, o pico de
+memória alocada (tracemalloc) e o tamanho do PDF. Com --compare o
+resultado é comparado com o baseline.json e o script termina com erro se
+alguma fixture ficar mais lenta ou maior que o tolerado.
+"""
+
+# pylint: disable=print-used
+import argparse
+import importlib
+import json
+import os
+import sys
+import time
+import tracemalloc
+import types
+from io import BytesIO
+
+import pytz
+from lxml import etree
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPORTS_DIR = os.path.join(os.path.dirname(BENCH_DIR), "reports")
+BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+
+sys.path.insert(0, BENCH_DIR)
+from nfe_generator import make_cce, make_nfe  # noqa: E402
+
+# (nome, kwargs do make_nfe, nr. de cartas de correção)
+FIXTURES = [
+    ("items_1", {"n_items": 1}, 0),
+    ("items_50", {"n_items": 50, "n_dup": 3}, 0),
+    ("items_500", {"n_items": 500, "n_dup": 3}, 0),
+    ("items_5000", {"n_items": 5000, "n_dup": 3}, 0),
+    ("long_inf_ad_prod", {"n_items": 200, "long_inf_ad_prod": True}, 0),
+    ("many_dup", {"n_items": 10, "n_dup": 120}, 0),
+    ("cce", {"n_items": 10, "n_dup": 3}, 5),
+]
+
+
+def load_danfe():
+    """Importa o reports/danfe.py sem passar pelo __init__ do módulo, que
+    depende do odoo."""
+    package = types.ModuleType("engenere_danfe_reports")
+    package.__path__ = [REPORTS_DIR]
+    sys.modules[package.__name__] = package
+    return importlib.import_module("engenere_danfe_reports.danfe")
+
+
+def render(danfe, nfe_xml, list_cce, timezone):
+    oDanfe = danfe.Danfe(
+        list_xml=[etree.fromstring(nfe_xml)],
+        cce_xml=[etree.fromstring(cce) for cce in list_cce] or None,
+        timezone=timezone,
+    )
+    tmpDanfe = BytesIO()
+    oDanfe.writeto_pdf(tmpDanfe)
+    return tmpDanfe.getvalue()
+
+
+def run_fixture(danfe, nfe_xml, list_cce, repeat, timezone):
+    # Primeira execução fora da medição: registro das fontes, imports
+    # preguiçosos do reportlab etc.
+    pdf = render(danfe, nfe_xml, list_cce, timezone)
+
+    times = []
+    for _i in range(repeat):
+        start = time.perf_counter()
+        render(danfe, nfe_xml, list_cce, timezone)
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    render(danfe, nfe_xml, list_cce, timezone)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    times.sort()
+    return {
+        "time_min": round(times[0], 4),
+        "time_median": round(times[len(times) // 2], 4),
+        "peak_mb": round(peak / 1024.0 / 1024.0, 2),
+        "pdf_kb": round(len(pdf) / 1024.0, 1),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Lista as fixtures que pioraram mais que a tolerância em relação ao
+    baseline."""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        for key in ("time_min", "peak_mb", "pdf_kb"):
+            if base[key] and result[key] > base[key] * (1 + tolerance):
+                regressions.append(
+                    "%s: %s %s -> %s" % (name, key, base[key], result[key])
+                )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--only", action="append", help="Executa apenas esta fixture (repetível)"
+    )
+    parser.add_argument("--save", action="store_true", help="Grava o baseline")
+    parser.add_argument("--compare", action="store_true", help="Compara com o baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--baseline", default=BASELINE)
+    args = parser.parse_args(argv)
+
+    danfe = load_danfe()
+    timezone = pytz.timezone("America/Sao_Paulo")
+
+    results = {}
+    for name, nfe_kwargs, n_cce in FIXTURES:
+        if args.only and name not in args.only:
+            continue
+        nfe_xml = make_nfe(**nfe_kwargs)
+        list_cce = [make_cce(seq) for seq in range(1, n_cce + 1)]
+        results[name] = run_fixture(danfe, nfe_xml, list_cce, args.repeat, timezone)
+        print(
+            "%-18s %8.4fs (mediana %8.4fs) %8.2f MB %10.1f KB"
+            % (
+                name,
+                results[name]["time_min"],
+                results[name]["time_median"],
+                results[name]["peak_mb"],
+                results[name]["pdf_kb"],
+            )
+        )
+
+    if args.save:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as fileObj:
+                baseline = json.load(fileObj)
+        baseline.update(results)
+        with open(args.baseline, "w") as fileObj:
+            json.dump(baseline, fileObj, indent=4, sort_keys=True)
+            fileObj.write("\n")
+
+    if args.compare:
+        with open(args.baseline) as fileObj:
+            regressions = compare(results, json.load(fileObj), args.tolerance)
+        for regression in regressions:
+            print("REGRESSÃO %s" % regression)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
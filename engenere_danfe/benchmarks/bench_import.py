@@ -0,0 +1,101 @@
+# Copyright 2023 Engenere.one
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+"""Custo de importar os geradores do DANFE em um processo novo.
+
+Uso::
+
+    python engenere_danfe/benchmarks/bench_import.py
+
+Cada módulo é importado em um interpretador separado, medido duas vezes:
+
+* base: com apenas lxml, pytz e PIL já carregados;
+* odoo: com também o que o ir_actions_report e o tools.pdf do odoo já
+  importam em todo worker (reportlab.graphics.barcode, PyPDF2).
+
+Mostra o tempo do import e o aumento do RSS máximo. As duas colunas
+superestimam o que um worker deixa de gastar enquanto não imprime nenhum
+DANFE: o worker do odoo já carregou a maior parte do reportlab, a
+economia real fica em poucos ms e menos de 1 MB. O erpbrasil.edoc.pdf não
+é medido, o l10n_br_nfe já o importa em todo worker.
+"""
+
+# pylint: disable=print-used
+import json
+import os
+import subprocess
+import sys
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# (nome, código que faz o import)
+IMPORTS = [
+    (
+        "danfe",
+        "from bench_danfe import load_danfe; load_danfe()",
+    ),
+    (
+        "danfe_pool",
+        "import importlib; from bench_danfe import load_danfe; load_danfe(); "
+        "importlib.import_module('engenere_danfe_reports.danfe_pool')",
+    ),
+]
+
+# Módulos carregados antes da medição, em cada cenário
+PRELOAD = [
+    ("base", "import lxml.etree, lxml.objectify, pytz, PIL.Image"),
+    (
+        "odoo",
+        "import lxml.etree, lxml.objectify, pytz, PIL.Image; "
+        "import reportlab.graphics.barcode, PyPDF2",
+    ),
+]
+
+CHILD = """
+import json, resource, sys, time
+sys.path.insert(0, %(bench_dir)r)
+%(preload)s
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.perf_counter()
+%(code)s
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    "ms": round(elapsed * 1000, 1),
+    "rss_mb": round((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss) / 1024.0, 1),
+}))
+"""
+
+
+def measure(preload, code):
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            CHILD % {"bench_dir": BENCH_DIR, "preload": preload, "code": code},
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    if result.returncode:
+        return None
+    return json.loads(result.stdout)
+
+
+def main():
+    print(
+        "%-20s %s" % ("", " ".join("%21s" % scenario for scenario, _preload in PRELOAD))
+    )
+    for name, code in IMPORTS:
+        columns = []
+        for _scenario, preload in PRELOAD:
+            result = measure(preload, code)
+            if result is None:
+                columns.append("%21s" % "não instalado")
+                continue
+            columns.append("%8.1f ms %7.1f MB" % (result["ms"], result["rss_mb"]))
+        print("%-20s %s" % (name, " ".join(columns)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,142 @@
+# Copyright 2023 Engenere.one
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+# Geração de XMLs sintéticos de NF-e 4.0 para os benchmarks do DANFE
+
+from datetime import date
+
+NFE_NS = "http://www.portalfiscal.inf.br/nfe"
+
+CHAVE = "35230512345678000199550010000012341000012345"
+
+INF_AD_PROD = "Lote 0001, validade 12/2025, pedido do cliente 4500012345. "
+
+
+def _det(nItem, long_inf_ad_prod=False):
+    vProd = 10.5 * nItem
+    infAdProd = ""
+    if long_inf_ad_prod:
+        # Texto com várias linhas no quadro de produtos
+        infAdProd = "<infAdProd>%s</infAdProd>" % (INF_AD_PROD * 8).strip()
+    return (
+        '<det nItem="%(nItem)s"><prod>'
+        "<cProd>PRODCODE%(nItem)06dXYZ</cProd><cEAN>SEM GTIN</cEAN>"
+        "<xProd>Produto sintetico numero %(nItem)s com descricao longa o "
+        "bastante para quebrar linha no DANFE</xProd>"
+        "<NCM>84713012</NCM><CFOP>5102</CFOP><uCom>UN</uCom>"
+        "<qCom>%(nItem)s.0000</qCom><vUnCom>10.50</vUnCom>"
+        "<vProd>%(vProd).2f</vProd><cEANTrib>SEM GTIN</cEANTrib>"
+        "<uTrib>UN</uTrib><qTrib>%(nItem)s.0000</qTrib>"
+        "<vUnTrib>10.50</vUnTrib><indTot>1</indTot></prod>"
+        "<imposto><ICMS><ICMS00><orig>0</orig><CST>00</CST><modBC>3</modBC>"
+        "<vBC>%(vProd).2f</vBC><pICMS>18.00</pICMS><vICMS>%(vICMS).2f</vICMS>"
+        "</ICMS00></ICMS><IPI><cEnq>999</cEnq><IPITrib><CST>50</CST>"
+        "<vBC>%(vProd).2f</vBC><pIPI>5.00</pIPI><vIPI>%(vIPI).2f</vIPI>"
+        "</IPITrib></IPI></imposto>%(infAdProd)s</det>"
+    ) % {
+        "nItem": nItem,
+        "vProd": vProd,
+        "vICMS": vProd * 0.18,
+        "vIPI": vProd * 0.05,
+        "infAdProd": infAdProd,
+    }
+
+
+def _cobr(n_dup):
+    if not n_dup:
+        return ""
+    dups = "".join(
+        "<dup><nDup>%03d</nDup><dVenc>%s</dVenc><vDup>100.00</vDup></dup>"
+        % (nDup, date(2023 + nDup // 12, nDup % 12 + 1, 10).isoformat())
+        for nDup in range(1, n_dup + 1)
+    )
+    return (
+        "<cobr><fat><nFat>1</nFat><vOrig>%(v).2f</vOrig><vDesc>0.00</vDesc>"
+        "<vLiq>%(v).2f</vLiq></fat>%(dups)s</cobr>" % {"v": 100.0 * n_dup, "dups": dups}
+    )
+
+
+def make_nfe(n_items=1, n_dup=0, long_inf_ad_prod=False, nNF=1234):
+    """XML autorizado (nfeProc) de uma NF-e com o nr. de itens e parcelas
+    informados.
+
+    :return: bytes do XML
+    """
+    dets = "".join(_det(i, long_inf_ad_prod) for i in range(1, n_items + 1))
+    xml = (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<nfeProc xmlns="%(ns)s" versao="4.00"><NFe>'
+        '<infNFe Id="NFe%(chave)s" versao="4.00">'
+        "<ide><cUF>35</cUF><cNF>00001234</cNF><natOp>Venda de mercadoria</natOp>"
+        "<mod>55</mod><serie>1</serie><nNF>%(nNF)s</nNF>"
+        "<dhEmi>2023-05-10T10:00:00-03:00</dhEmi>"
+        "<dhSaiEnt>2023-05-10T10:00:00-03:00</dhSaiEnt><tpNF>1</tpNF>"
+        "<idDest>1</idDest><cMunFG>3550308</cMunFG><tpImp>1</tpImp>"
+        "<tpEmis>1</tpEmis><cDV>5</cDV><tpAmb>2</tpAmb><finNFe>1</finNFe>"
+        "<indFinal>0</indFinal><indPres>9</indPres><procEmi>0</procEmi>"
+        "<verProc>1.0</verProc></ide>"
+        "<emit><CNPJ>12345678000199</CNPJ><xNome>Empresa Emitente Ltda</xNome>"
+        "<enderEmit><xLgr>Rua A</xLgr><nro>10</nro><xCpl>Sala 1</xCpl>"
+        "<xBairro>Centro</xBairro><cMun>3550308</cMun><xMun>Sao Paulo</xMun>"
+        "<UF>SP</UF><CEP>01000000</CEP><fone>1133334444</fone></enderEmit>"
+        "<IE>123456789</IE><CRT>3</CRT></emit>"
+        "<dest><CNPJ>98765432000188</CNPJ><xNome>Cliente Destinatario SA</xNome>"
+        "<enderDest><xLgr>Av B</xLgr><nro>200</nro><xBairro>Jardim</xBairro>"
+        "<cMun>3509502</cMun><xMun>Campinas</xMun><UF>SP</UF><CEP>13000000</CEP>"
+        "<fone>1933332222</fone></enderDest><indIEDest>1</indIEDest>"
+        "<IE>987654321</IE></dest>"
+        "%(dets)s"
+        "<total><ICMSTot><vBC>100.00</vBC><vICMS>18.00</vICMS>"
+        "<vICMSDeson>0.00</vICMSDeson><vFCP>0.00</vFCP><vBCST>0.00</vBCST>"
+        "<vST>0.00</vST><vFCPST>0.00</vFCPST><vFCPSTRet>0.00</vFCPSTRet>"
+        "<vProd>100.00</vProd><vFrete>0.00</vFrete><vSeg>0.00</vSeg>"
+        "<vDesc>0.00</vDesc><vII>0.00</vII><vIPI>5.00</vIPI>"
+        "<vIPIDevol>0.00</vIPIDevol><vPIS>0.00</vPIS><vCOFINS>0.00</vCOFINS>"
+        "<vOutro>0.00</vOutro><vNF>105.00</vNF><vTotTrib>10.00</vTotTrib>"
+        "</ICMSTot></total>"
+        "<transp><modFrete>0</modFrete><transporta><CNPJ>11222333000144</CNPJ>"
+        "<xNome>Transportadora X</xNome><IE>111</IE><xEnder>Rua C</xEnder>"
+        "<xMun>Santos</xMun><UF>SP</UF></transporta><veicTransp>"
+        "<placa>ABC1234</placa><UF>SP</UF></veicTransp><vol><qVol>1</qVol>"
+        "<esp>CX</esp><pesoL>1.000</pesoL><pesoB>1.200</pesoB></vol></transp>"
+        "%(cobr)s"
+        "<pag><detPag><tPag>15</tPag><vPag>105.00</vPag></detPag></pag>"
+        "<infAdic><infAdFisco>Informacoes de interesse do fisco</infAdFisco>"
+        "<infCpl>Informacoes complementares</infCpl>"
+        '<obsCont xCampo="CodVendedor"><xTexto>V01</xTexto></obsCont>'
+        '<obsCont xCampo="NomeVendedor"><xTexto>Vendedor</xTexto></obsCont>'
+        "</infAdic></infNFe></NFe>"
+        '<protNFe versao="4.00"><infProt><tpAmb>2</tpAmb>'
+        "<verAplic>SP_NFE_PL009_V4</verAplic><chNFe>%(chave)s</chNFe>"
+        "<dhRecbto>2023-05-10T10:05:00-03:00</dhRecbto>"
+        "<nProt>135230000000001</nProt><digVal>ZGlnVmFs</digVal>"
+        "<cStat>100</cStat><xMotivo>Autorizado o uso da NF-e</xMotivo>"
+        "</infProt></protNFe></nfeProc>"
+    ) % {
+        "ns": NFE_NS,
+        "chave": CHAVE,
+        "nNF": nNF,
+        "dets": dets,
+        "cobr": _cobr(n_dup),
+    }
+    return xml.encode()
+
+
+def make_cce(nSeqEvento=1):
+    """XML de uma carta de correção (procEventoNFe, tpEvento 110110).
+
+    :return: bytes do XML
+    """
+    xml = (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<procEventoNFe xmlns="%(ns)s" versao="1.00"><evento versao="1.00">'
+        '<infEvento Id="ID110110%(chave)s%(seq)02d"><cOrgao>35</cOrgao>'
+        "<tpAmb>2</tpAmb><CNPJ>12345678000199</CNPJ><chNFe>%(chave)s</chNFe>"
+        "<dhEvento>2023-05-11T09:00:00-03:00</dhEvento><tpEvento>110110</tpEvento>"
+        "<nSeqEvento>%(seq)s</nSeqEvento><verEvento>1.00</verEvento>"
+        '<detEvento versao="1.00"><descEvento>Carta de Correcao</descEvento>'
+        "<xCorrecao>Correcao numero %(seq)s do endereco de entrega</xCorrecao>"
+        "<xCondUso>A Carta de Correcao e disciplinada pelo paragrafo 1o-A do "
+        "art. 7o do Convenio S/N, de 15 de dezembro de 1970</xCondUso>"
+        "</detEvento></infEvento></evento></procEventoNFe>"
+    ) % {"ns": NFE_NS, "chave": CHAVE, "seq": nSeqEvento}
+    return xml.encode()
@@ -0,0 +1,215 @@
+# Copyright 2023 Engenere.one
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+# Geração em lote de DANFEs pela linha de comando, sem banco de dados
+# pylint: disable=print-used
+
+import argparse
+import multiprocessing
+import os
+import sys
+import tarfile
+import time
+import zipfile
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from odoo.cli import Command
+
+
+def iter_xml_files(cInput):
+    """Percorre os XMLs de um diretório ou de um arquivo tar, lido como
+    stream ("-" lê o tar da entrada padrão).
+
+    :return: gerador de (nome do PDF, bytes do XML)
+    """
+    if os.path.isdir(cInput):
+        for root, dirs, files in os.walk(cInput):
+            dirs.sort()
+            for cFile in sorted(files):
+                if not cFile.lower().endswith(".xml"):
+                    continue
+                cPath = os.path.join(root, cFile)
+                with open(cPath, "rb") as fileObj:
+                    yield os.path.relpath(cPath, cInput)[:-4] + ".pdf", fileObj.read()
+        return
+
+    if cInput == "-":
+        tar = tarfile.open(fileobj=sys.stdin.buffer, mode="r|*")
+    else:
+        tar = tarfile.open(cInput, mode="r|*")
+    with tar:
+        for member in tar:
+            if not member.isfile() or not member.name.lower().endswith(".xml"):
+                continue
+            cName = os.path.normpath(member.name)[:-4] + ".pdf"
+            yield cName, tar.extractfile(member).read()
+
+
+def render_file(xml, logo, tz_name, stream_size=0):
+    """Gera o PDF de um XML no processo filho.
+
+    Os erros voltam como texto, nem toda exceção do lxml pode ser enviada
+    de volta ao processo principal.
+
+    :return: (bytes do PDF, None) ou (None, mensagem de erro)
+    """
+    from ..reports.danfe_pool import render_chunk
+
+    try:
+        pdf, _stats = render_chunk([xml], [logo], tz_name, stream_size=stream_size)
+        return pdf, None
+    except Exception as e:
+        return None, str(e)
+
+
+def check_name(cName):
+    """Nomes vindos do tar podem ser absolutos ou subir diretórios com
+    "..", o PDF seria gravado fora da saída."""
+    if os.path.isabs(cName) or cName.split(os.sep)[0] == os.pardir:
+        raise ValueError("unsafe path %s" % cName)
+
+
+class DirectoryWriter(object):
+    def __init__(self, cPath):
+        self.cPath = os.path.realpath(cPath)
+        os.makedirs(self.cPath, exist_ok=True)
+
+    def write(self, cName, pdf):
+        check_name(cName)
+        cFile = os.path.realpath(os.path.join(self.cPath, cName))
+        if os.path.commonpath([self.cPath, cFile]) != self.cPath:
+            raise ValueError("unsafe path %s" % cName)
+        os.makedirs(os.path.dirname(cFile), exist_ok=True)
+        with open(cFile, "wb") as fileObj:
+            fileObj.write(pdf)
+
+    def close(self):
+        pass
+
+
+class ZipWriter(object):
+    def __init__(self, cPath):
+        self.zip = zipfile.ZipFile(cPath, "w", zipfile.ZIP_DEFLATED)
+
+    def write(self, cName, pdf):
+        check_name(cName)
+        self.zip.writestr(cName, pdf)
+
+    def close(self):
+        self.zip.close()
+
+
+class Danfe(Command):
+    """Render DANFE PDFs from a directory or tar of NF-e XMLs"""
+
+    def run(self, cmdargs):
+        parser = argparse.ArgumentParser(
+            prog="%s danfe" % os.path.basename(sys.argv[0]),
+            description=self.__doc__,
+        )
+        parser.add_argument(
+            "input", help="Directory or tar file with the XMLs, '-' reads a tar stream"
+        )
+        parser.add_argument(
+            "-o", "--output", required=True, help="Output directory or .zip file"
+        )
+        parser.add_argument(
+            "-j",
+            "--jobs",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="Number of rendering processes (default: number of CPUs)",
+        )
+        parser.add_argument("--logo", help="Image printed on every DANFE")
+        parser.add_argument(
+            "--tz", default="America/Sao_Paulo", help="Timezone of the printed dates"
+        )
+        parser.add_argument(
+            "--stream-threshold",
+            type=int,
+            default=0,
+            help="XMLs larger than this many KB are read item by item with "
+            "iterparse, twice (default: 0, disabled)",
+        )
+        args = parser.parse_args(args=cmdargs)
+
+        # Importado aqui e não no módulo, que é carregado com o addon em todo
+        # worker. Os processos filhos já recebem o gerador carregado.
+        from ..reports.danfe import scale_logo
+        from ..reports.danfe_pool import render_chunk  # noqa: F401
+
+        logo = False
+        if args.logo:
+            with open(args.logo, "rb") as fileObj:
+                logo = scale_logo(fileObj.read())
+
+        if args.output.lower().endswith(".zip"):
+            writer = ZipWriter(args.output)
+        else:
+            writer = DirectoryWriter(args.output)
+
+        start = time.perf_counter()
+        try:
+            nDone, list_error = self.render(
+                iter_xml_files(args.input),
+                writer,
+                args.jobs,
+                logo,
+                args.tz,
+                args.stream_threshold * 1024,
+            )
+        finally:
+            writer.close()
+        elapsed = time.perf_counter() - start
+
+        for cName, error in list_error:
+            print("%s: %s" % (cName, error), file=sys.stderr)
+        print(
+            "%s DANFEs in %.1fs (%.1f/s), %s errors"
+            % (nDone, elapsed, nDone / elapsed if elapsed else 0, len(list_error))
+        )
+        sys.exit(1 if list_error else 0)
+
+    def render(self, files, writer, jobs, logo, tz_name, stream_size=0):
+        """Gera um PDF por XML, mantendo no máximo alguns XMLs por processo
+        em memória, e grava cada PDF assim que fica pronto.
+
+        :return: nr. de PDFs gerados e lista de (nome, erro)
+        """
+        nDone = 0
+        list_error = []
+
+        def write(cName, pdf, error):
+            nonlocal nDone
+            if not error:
+                try:
+                    writer.write(cName, pdf)
+                except ValueError as e:
+                    error = str(e)
+            if error:
+                list_error.append((cName, error))
+                return
+            nDone += 1
+
+        if jobs <= 1:
+            for cName, xml in files:
+                write(cName, *render_file(xml, logo, tz_name, stream_size))
+            return nDone, list_error
+
+        with ProcessPoolExecutor(
+            max_workers=jobs, mp_context=multiprocessing.get_context("fork")
+        ) as executor:
+            pending = {}
+
+            def collect(return_when):
+                done, _not_done = wait(pending, return_when=return_when)
+                for future in done:
+                    write(pending.pop(future), *future.result())
+
+            for cName, xml in files:
+                if len(pending) >= jobs * 4:
+                    collect(FIRST_COMPLETED)
+                future = executor.submit(render_file, xml, logo, tz_name, stream_size)
+                pending[future] = cName
+            if pending:
+                collect(ALL_COMPLETED)
+        return nDone, list_error
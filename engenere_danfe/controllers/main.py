@@ -0,0 +1,110 @@
+# Copyright 2023 Engenere.one
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+from io import BytesIO
+
+from werkzeug.wsgi import wrap_file
+
+import odoo
+from odoo import api, http
+from odoo.exceptions import AccessError
+from odoo.http import content_disposition, request
+
+from odoo.addons.l10n_br_fiscal.constants.fiscal import MODELO_FISCAL_NFE
+
+
+def _stream_export(dbname, uid, context, domain):
+    # O cursor e o ambiente da requisição são fechados antes da resposta ser
+    # enviada, o zip é gerado com um cursor e um ambiente próprios enquanto
+    # é transmitido
+    with api.Environment.manage(), odoo.registry(dbname).cursor() as cr:
+        env = api.Environment(cr, uid, context)
+        yield from env["l10n_br_fiscal.document"]._iter_danfe_export(domain)
+
+
+def _open_attachment(attachment):
+    """Arquivo do anexo aberto direto no filestore, sem carregá-lo na
+    memória. Anexos guardados no banco são lidos inteiros."""
+    if attachment.store_fname:
+        return open(attachment._full_path(attachment.store_fname), "rb")
+    return BytesIO(attachment.raw)
+
+
+class DanfeController(http.Controller):
+    @http.route(
+        "/engenere_danfe/danfe/<string:document_key>.pdf", type="http", auth="user"
+    )
+    def download_danfe(self, document_key, **kwargs):
+        """DANFE da nota pela chave de acesso, com ETag para que clientes
+        que já têm o PDF recebam apenas um 304."""
+        document = request.env["l10n_br_fiscal.document"].search(
+            [
+                ("document_key", "=", document_key),
+                ("document_type_id.code", "=", MODELO_FISCAL_NFE),
+            ],
+            limit=1,
+        )
+        if not document or not document.move_ids:
+            return request.not_found()
+
+        headers = [("Cache-Control", "private, no-cache")]
+        if_none_match = request.httprequest.if_none_match
+        report = request.env.ref("engenere_danfe.report_engenere_danfe")
+        # A ETag é a chave do DANFE calculada dos arquivos atuais da nota,
+        # uma nova CC-e, outro logo ou outra versão do gerador a mudam. O
+        # PDF só é gerado, com as permissões do usuário, se ela não confere.
+        # Quem só pode ler a nota recebe o DANFE já guardado.
+        try:
+            with request.env.cr.savepoint():
+                etag, danfe_data = document._get_danfe_data(report)
+                if if_none_match.contains(etag):
+                    return self._not_modified(etag, headers)
+                attachment = document._get_danfe_download(report, etag, danfe_data)
+        except AccessError:
+            attachment = document.file_report_id
+            if not attachment:
+                raise
+            etag = attachment.danfe_cache_key
+            if etag and if_none_match.contains(etag):
+                return self._not_modified(etag, headers)
+
+        headers += [
+            ("Content-Type", "application/pdf"),
+            ("Content-Length", attachment.file_size),
+            ("Content-Disposition", content_disposition(attachment.name)),
+        ]
+        response = http.Response(
+            wrap_file(request.httprequest.environ, _open_attachment(attachment)),
+            headers=headers,
+            direct_passthrough=True,
+        )
+        if etag:
+            response.set_etag(etag)
+        return response
+
+    def _not_modified(self, etag, headers):
+        response = http.Response(status=304, headers=headers)
+        response.set_etag(etag)
+        return response
+
+    @http.route("/engenere_danfe/export/<int:wizard_id>", type="http", auth="user")
+    def export_danfe(self, wizard_id, **kwargs):
+        wizard = request.env["engenere_danfe.export.wizard"].browse(wizard_id).exists()
+        if not wizard:
+            return request.not_found()
+
+        return request.make_response(
+            _stream_export(
+                request.env.cr.dbname,
+                request.env.uid,
+                dict(request.env.context, allowed_company_ids=wizard.company_id.ids),
+                wizard._get_export_domain(),
+            ),
+            headers=[
+                ("Content-Type", "application/zip"),
+                (
+                    "Content-Disposition",
+                    content_disposition(wizard._get_export_filename()),
+                ),
+            ],
+        )
@@ -1 +1,2 @@
+from . import ir_attachment
 from . import l10n_br_fiscal_document
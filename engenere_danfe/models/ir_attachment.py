@@ -0,0 +1,52 @@
+# Copyright 2023 Engenere.one
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+from datetime import timedelta
+
+from odoo import api, fields, models
+
+
+class IrAttachment(models.Model):
+
+    _inherit = "ir.attachment"
+
+    danfe_cache_key = fields.Char(
+        string="DANFE Cache Key",
+        index=True,
+        readonly=True,
+        copy=False,
+        help="Hash of the XML, logo, timezone and renderer version used to "
+        "generate this DANFE.",
+    )
+
+    @api.model
+    def _gc_danfe_cache(self):
+        """Remove os DANFEs em cache que não são mais o relatório atual de
+        nenhum documento, quando ultrapassam a idade máxima
+        (engenere_danfe.cache_max_age_days) ou o tamanho total máximo
+        (engenere_danfe.cache_max_size_mb, 0 sem limite)."""
+        ICP = self.env["ir.config_parameter"].sudo()
+        max_age = int(ICP.get_param("engenere_danfe.cache_max_age_days", 30))
+        max_size = int(ICP.get_param("engenere_danfe.cache_max_size_mb", 0))
+        max_size *= 1024 * 1024
+
+        cached = self.sudo().search(
+            [("danfe_cache_key", "!=", False)], order="create_date desc, id desc"
+        )
+        in_use = (
+            self.env["l10n_br_fiscal.document"]
+            .sudo()
+            .search([("file_report_id", "in", cached.ids)])
+            .mapped("file_report_id")
+        )
+
+        limit_date = fields.Datetime.now() - timedelta(days=max_age)
+        total_size = 0
+        to_remove = self.browse()
+        for attachment in cached - in_use:
+            total_size += attachment.file_size
+            if attachment.create_date < limit_date or (
+                max_size and total_size > max_size
+            ):
+                to_remove |= attachment
+        to_remove.unlink()
@@ -1,16 +1,21 @@
 # Copyright 2023 Engenere.one
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
 
-import base64
+import logging
+import zipfile
 
-from odoo import models
+from odoo import api, fields, models
+from odoo.tools import split_every
 
 from odoo.addons.l10n_br_fiscal.constants.fiscal import (
     MODELO_FISCAL_NFCE,
     MODELO_FISCAL_NFE,
     PROCESSADOR_OCA,
+    SITUACAO_EDOC_AUTORIZADA,
 )
 
+_logger = logging.getLogger(__name__)
+
 
 def filter_processador_edoc_nfe(record):
     if record.processador_edoc == PROCESSADOR_OCA and record.document_type_id.code in [
@@ -21,24 +26,218 @@ def filter_processador_edoc_nfe(record):
     return False
 
 
+class ZipStream(object):
+    """Arquivo somente de escrita para o zipfile. Os bytes gravados são
+    retirados com pop() à medida que o zip é gerado."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
 class L10nBrFiscalDocument(models.Model):
 
     _inherit = "l10n_br_fiscal.document"
 
+    danfe_pending = fields.Boolean(
+        string="DANFE Pending",
+        index=True,
+        readonly=True,
+        copy=False,
+        help="The DANFE will be generated in background by a scheduled action.",
+    )
+
+    def _danfe_async_enabled(self):
+        return bool(
+            self.env["ir.config_parameter"]
+            .sudo()
+            .get_param("engenere_danfe.async_generation")
+        )
+
+    def _exec_after_SITUACAO_EDOC_AUTORIZADA(self, old_state, new_state):
+        # O make_pdf é chamado pelo l10n_br_nfe dentro deste método, a
+        # dependência garante que o contexto já chega com o adiamento
+        if self._danfe_async_enabled():
+            self = self.with_context(engenere_danfe_defer=True)
+        return super(L10nBrFiscalDocument, self)._exec_after_SITUACAO_EDOC_AUTORIZADA(
+            old_state, new_state
+        )
+
     def make_pdf(self):
-        if not self.filtered(filter_processador_edoc_nfe):
+        documents = self.filtered(filter_processador_edoc_nfe)
+        if not documents:
             return super().make_pdf()
 
+        if self.env.context.get("engenere_danfe_defer"):
+            # Gerado depois pelo _cron_generate_pending_danfe
+            documents.write({"danfe_pending": True})
+            return
+
         report = self.env.ref("engenere_danfe.report_engenere_danfe")
-        pdf_data = report._render_qweb_pdf(self.move_ids.ids)  # Gera o PDF
+        for document in documents:
+            document._make_danfe_pdf(report)
+
+    def _get_danfe_data(self, report):
+        """Arquivos usados na geração do DANFE do documento e a chave de
+        cache calculada a partir deles.
+
+        :return: (chave, dict com xml_by_move, logo_by_move e cce_by_move)
+        """
+        self.ensure_one()
+        moves = self.move_ids
+        danfe_data = {
+            "xml_by_move": report._get_danfe_xml_files(moves),
+            "logo_by_move": report._get_danfe_logos(moves),
+            "cce_by_move": report._get_danfe_cce_files(moves),
+        }
+        return report._get_danfe_cache_key(moves, **danfe_data), danfe_data
 
-        self.file_report_id = self.env["ir.attachment"].create(
+    def _get_danfe_attachment(self, report, cache_key, danfe_data):
+        """DANFE do documento com a chave de cache, gerado só se ainda não
+        existe um anexo com ela.
+
+        :return: ir.attachment do DANFE
+        """
+        self.ensure_one()
+        attachment = self.env["ir.attachment"].search(
+            [
+                ("res_model", "=", self._name),
+                ("res_id", "=", self.id),
+                ("danfe_cache_key", "=", cache_key),
+            ],
+            limit=1,
+        )
+        if attachment:
+            return attachment
+        pdf_data = report._render_danfe_batch(self.move_ids, **danfe_data)
+        return self.env["ir.attachment"].create(
             {
                 "name": self.document_key + ".pdf",
                 "res_model": self._name,
                 "res_id": self.id,
-                "datas": base64.b64encode(pdf_data[0]),
+                # bytes direto no filestore, sem o base64 do datas
+                "raw": pdf_data,
                 "mimetype": "application/pdf",
                 "type": "binary",
+                "danfe_cache_key": cache_key,
             }
         )
+
+    def _make_danfe_pdf(self, report):
+        """Gera o DANFE do documento, reaproveitando o PDF já existente se
+        nada que influencia o resultado mudou.
+
+        :return: ir.attachment do DANFE
+        """
+        self.ensure_one()
+        cache_key, danfe_data = self._get_danfe_data(report)
+        attachment = self._get_danfe_attachment(report, cache_key, danfe_data)
+
+        vals = {}
+        if self.file_report_id != attachment:
+            vals["file_report_id"] = attachment.id
+        if self.danfe_pending:
+            vals["danfe_pending"] = False
+        if vals:
+            self.write(vals)
+        return attachment
+
+    def _get_danfe_download(self, report, cache_key, danfe_data):
+        """DANFE atual da nota para download, a chave de cache serve de
+        ETag. O file_report_id não é alterado: a chave inclui o timezone de
+        quem baixa, usuários em timezones diferentes trocariam o DANFE
+        da nota a cada download. Os PDFs gerados aqui ficam só em cache e
+        são removidos pelo _gc_danfe_cache.
+
+        :return: ir.attachment do DANFE
+        """
+        self.ensure_one()
+        if self.file_report_id.danfe_cache_key == cache_key:
+            return self.file_report_id
+        return self._get_danfe_attachment(report, cache_key, danfe_data)
+
+    @api.model
+    def _cron_generate_pending_danfe(self, batch_size=50):
+        """Gera os DANFEs das notas autorizadas com a geração em segundo
+        plano, em lotes por empresa."""
+        report = self.env.ref("engenere_danfe.report_engenere_danfe")
+        pending = self.search([("danfe_pending", "=", True)], order="company_id, id")
+        ids_by_company = {}
+        for document in pending:
+            ids_by_company.setdefault(document.company_id, []).append(document.id)
+        for company, company_ids in ids_by_company.items():
+            for ids in split_every(batch_size, company_ids):
+                documents = self.with_company(company).browse(ids)
+                for document in documents:
+                    try:
+                        # _make_danfe_pdf retira a nota da fila
+                        with self.env.cr.savepoint():
+                            document._make_danfe_pdf(report)
+                    except Exception as e:
+                        # A falha não trava o lote, a nota continua pendente
+                        # e é tentada de novo na próxima execução
+                        _logger.error("DANFE Error %s \n %s", document.document_key, e)
+                self.env.cr.commit()  # pylint: disable=invalid-commit
+
+    @api.model
+    def _get_danfe_export_domain(self, company, date_start, date_end):
+        """Notas autorizadas da empresa com document_date no intervalo
+        [date_start, date_end), datetimes em UTC sem tzinfo."""
+        return [
+            ("company_id", "=", company.id),
+            ("document_type_id.code", "=", MODELO_FISCAL_NFE),
+            ("state_edoc", "=", SITUACAO_EDOC_AUTORIZADA),
+            ("document_date", ">=", date_start),
+            ("document_date", "<", date_end),
+        ]
+
+    @api.model
+    def _iter_danfe_export(self, domain, batch_size=100):
+        """Gera aos poucos um zip com o XML de autorização e o DANFE das
+        notas do domínio.
+
+        As notas são lidas em lotes e o cache do ambiente é limpo a cada
+        lote, a memória usada não depende do nr. de notas exportadas.
+
+        :return: gerador com os bytes do zip
+        """
+        report = self.env.ref("engenere_danfe.report_engenere_danfe")
+        stream = ZipStream()
+        with zipfile.ZipFile(stream, "w", zipfile.ZIP_DEFLATED) as zip_file:
+            for ids in split_every(batch_size, self.search(domain, order="id").ids):
+                for document in self.browse(ids):
+                    xml_file = document.authorization_file_id or document.send_file_id
+                    if xml_file:
+                        zip_file.writestr(document.document_key + ".xml", xml_file.raw)
+                    pdf = document._get_danfe_export_pdf(report)
+                    if pdf:
+                        zip_file.writestr(document.document_key + ".pdf", pdf)
+                    yield stream.pop()
+                self.invalidate_cache()
+        # Diretório central do zip
+        yield stream.pop()
+
+    def _get_danfe_export_pdf(self, report):
+        """DANFE já armazenado da nota ou, se não houver, gerado na hora
+        sem gravar nada no banco."""
+        self.ensure_one()
+        if self.file_report_id:
+            return self.file_report_id.raw
+        if not self.move_ids or not filter_processador_edoc_nfe(self):
+            return False
+        try:
+            return report._render_danfe_batch(self.move_ids)
+        except Exception as e:
+            _logger.error("DANFE Error %s \n %s", self.document_key, e)
+            return False
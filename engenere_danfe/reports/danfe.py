@@ -2,25 +2,39 @@
 # License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl.html).
 # Classe para geração de PDF da DANFE a partir de xml etree.fromstring
 
-import math
+import json
+import logging
 import os
+import time
+from copy import copy
 from datetime import datetime, timedelta
+from functools import lru_cache
 from io import BytesIO
+from itertools import islice
 from textwrap import wrap
 
 import pytz
+from PIL import Image as PILImage
 from reportlab.graphics.barcode import code128
 from reportlab.lib import utils
 from reportlab.lib.colors import black, gray
 from reportlab.lib.enums import TA_CENTER
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
-from reportlab.lib.units import cm, mm
+from reportlab.lib.units import cm, inch, mm
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.pdfgen import canvas
 from reportlab.platypus import Image, Paragraph
 
+from .nfe_data import NFeData, NFeStream
+
+_logger = logging.getLogger(__name__)
+
+# Deve ser incrementada sempre que o layout gerado mudar, invalida os PDFs
+# já armazenados em cache
+RENDERER_VERSION = "2"
+
 
 def chunks(cString, nLen):
     for start in range(0, len(cString), nLen):
@@ -112,6 +126,261 @@ def get_image(path, width=1 * cm):
     return Image(path, width=width, height=(width * aspect))
 
 
+LOGO_WIDTH = 2 * cm
+
+
+def scale_logo(logo, width=LOGO_WIDTH, dpi=300):
+    """Reduz o logo para a resolução de impressão no DANFE.
+
+    :param logo: bytes da imagem
+    :param width: largura impressa, em pontos
+    :param dpi: resolução desejada
+    :return: bytes PNG, ou o próprio logo se ele já for pequeno
+    """
+    img = PILImage.open(BytesIO(logo))
+    nWidth = int(width / inch * dpi)
+    if img.width <= nWidth:
+        return logo
+    if img.mode not in ("RGB", "RGBA", "L", "LA"):
+        img = img.convert("RGBA")
+    nHeight = max(1, round(img.height * nWidth / img.width))
+    img = img.resize((nWidth, nHeight), PILImage.LANCZOS)
+    tmpLogo = BytesIO()
+    img.save(tmpLogo, format="PNG")
+    return tmpLogo.getvalue()
+
+
+FONTS = {
+    "NimbusSanL-Regu": "NimbusSanL Regular.ttf",
+    "NimbusSanL-Bold": "NimbusSanL Bold.ttf",
+}
+
+
+def register_fonts():
+    """Registra as fontes do DANFE no reportlab.
+
+    O registro vale para todo o processo, os arquivos TTF são lidos apenas
+    no primeiro DANFE gerado pelo worker.
+    """
+    registered = pdfmetrics.getRegisteredFontNames()
+    path = os.path.join(os.path.dirname(__file__), "fonts")
+    for cName, cFile in FONTS.items():
+        if cName not in registered:
+            pdfmetrics.registerFont(TTFont(cName, os.path.join(path, cFile)))
+
+
+@lru_cache(maxsize=256)
+def _barcode(cChave):
+    return code128.Code128(cChave, barHeight=10 * mm, barWidth=0.25 * mm)
+
+
+def get_barcode(cChave):
+    """Código de barras da chave de acesso, codificado uma única vez por
+    processo e reaproveitado entre as páginas e as impressões da mesma nota.
+
+    Retorna uma cópia rasa pois o drawOn guarda o canvas no próprio objeto,
+    o que não é seguro entre threads do servidor.
+    """
+    return copy(_barcode(cChave))
+
+
+# Altura, em linhas de 2.5mm, do quadro de produtos na primeira página e nas
+# páginas de continuação
+PRODUCT_LINES_FIRST_PAGE = 29
+PRODUCT_LINES_NEXT_PAGE = 77
+
+
+class ItemRow(object):
+    """Linha do quadro de produtos já formatada para impressão."""
+
+    __slots__ = ("cells", "list_cod", "list_desc", "nLines")
+
+    def __init__(self, item):
+        # Mesma ordem das colunas desenhadas em Danfe.produtos
+        self.cells = (
+            item.NCM,
+            item.orig + (item.CST or item.CSOSN),
+            item.CFOP,
+            item.uCom,
+            format_number(item.qCom),
+            format_number(item.vUnCom),
+            format_number(item.vProd),
+            format_number(item.vBC or "0.00"),
+            format_number(item.vICMS or "0.00"),
+            format_number(item.pICMS or "0.00"),
+            format_number(item.vIPI or "0.00"),
+            format_number(item.pIPI or "0.00"),
+        )
+        self.list_cod = wrap(item.cProd, 14)
+        self.list_desc = wrap(item.xProd, 50)
+        if item.infAdProd:
+            self.list_desc.extend(wrap(item.infAdProd, 50))
+        self.nLines = max(len(self.list_cod), len(self.list_desc))
+
+
+def plan_page_sizes(
+    iter_nLines, nFirst=PRODUCT_LINES_FIRST_PAGE, nNext=PRODUCT_LINES_NEXT_PAGE
+):
+    """Distribui as linhas do quadro de produtos pelas páginas do DANFE.
+
+    A primeira linha do quadro fica sob o cabeçalho das colunas, por isso
+    cada página comporta uma linha a menos que a altura do quadro. Um item
+    maior que uma página inteira de continuação é impresso sozinho.
+
+    :param iter_nLines: nr. de linhas de cada item, na ordem da nota
+    :return: lista com o nr. de itens de cada página, ao menos uma página
+    """
+    list_size = []
+    nCount = 0
+    nCapacity = nFirst - 1
+    nUsed = 0
+    for nLines in iter_nLines:
+        if nUsed + nLines > nCapacity and (nCount or not list_size):
+            list_size.append(nCount)
+            nCount = 0
+            nCapacity = nNext - 1
+            nUsed = 0
+        nCount += 1
+        nUsed += nLines
+    list_size.append(nCount)
+    return list_size
+
+
+def plan_pages(
+    list_row, nFirst=PRODUCT_LINES_FIRST_PAGE, nNext=PRODUCT_LINES_NEXT_PAGE
+):
+    """:return: lista com as linhas de cada página, ao menos uma página"""
+    list_page = []
+    nStart = 0
+    for nCount in plan_page_sizes((row.nLines for row in list_row), nFirst, nNext):
+        list_page.append(list_row[nStart : nStart + nCount])
+        nStart += nCount
+    return list_page
+
+
+class DanfeProfiler(object):
+    """Tempo e nr. de chamadas de cada seção do DANFE.
+
+    Registra uma linha de log por nota e outra com o total do lote. As
+    cartas de correção de list_cce entram na linha da nota; as de cce_xml,
+    impressas depois de todas as notas, e o canvas.save() entram apenas no
+    total do lote.
+
+    :param log_batch: False para os grupos de notas do pool, o total de
+        cada grupo volta com get_stats() e é somado com merge() no total
+        do lote
+    """
+
+    SECTIONS = (
+        "recibo_entrega",
+        "ide_emit",
+        "destinatario",
+        "entrega_retirada",
+        "faturas",
+        "impostos",
+        "transportes",
+        "produtos",
+        "calculo_issqn",
+        "adicionais",
+        "_generate_cce",
+    )
+
+    def __init__(self, log_batch=True):
+        self.start = time.perf_counter()
+        self.start_doc = self.start
+        self.log_batch = log_batch
+        self.nDocs = 0
+        self.sections = {}
+        self.totals = {}
+
+    def instrument(self, oDanfe):
+        """Troca as seções e o canvas.save() do Danfe por versões medidas."""
+        for cName in self.SECTIONS:
+            setattr(oDanfe, cName, self.wrap(cName, getattr(oDanfe, cName)))
+        oDanfe.canvas.save = self.wrap("save", oDanfe.canvas.save)
+
+    def wrap(self, cName, method):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.add(cName, time.perf_counter() - start)
+
+        return timed
+
+    def add(self, cName, elapsed):
+        for stats in (self.sections, self.totals):
+            calls, total = stats.get(cName, (0, 0.0))
+            stats[cName] = (calls + 1, total + elapsed)
+
+    def get_stats(self):
+        """Total medido, em um dict que pode ser enviado a outro processo."""
+        return {"documents": self.nDocs, "totals": self.totals}
+
+    def merge(self, stats):
+        """Soma ao total do lote o get_stats() de outro profiler."""
+        self.nDocs += stats["documents"]
+        for cName, (calls, total) in stats["totals"].items():
+            old_calls, old_total = self.totals.get(cName, (0, 0.0))
+            self.totals[cName] = (old_calls + calls, old_total + total)
+
+    @staticmethod
+    def _format(stats):
+        return {
+            cName: {"calls": calls, "ms": round(total * 1000, 2)}
+            for cName, (calls, total) in stats.items()
+        }
+
+    def start_document(self):
+        self.start_doc = time.perf_counter()
+        self.sections = {}
+
+    def end_document(self, oNFe, nItems):
+        self.nDocs += 1
+        _logger.info(
+            "DANFE profile %s",
+            json.dumps(
+                {
+                    "chave": oNFe.chave,
+                    "items": nItems,
+                    "ms": round((time.perf_counter() - self.start_doc) * 1000, 2),
+                    "sections": self._format(self.sections),
+                }
+            ),
+        )
+
+    def end_batch(self):
+        if not self.log_batch:
+            return
+        _logger.info(
+            "DANFE profile batch %s",
+            json.dumps(
+                {
+                    "documents": self.nDocs,
+                    "ms": round((time.perf_counter() - self.start) * 1000, 2),
+                    "sections": self._format(self.totals),
+                }
+            ),
+        )
+
+
+class _NullProfiler(object):
+    """Usado quando a medição está desligada, não faz nada."""
+
+    def instrument(self, oDanfe):
+        pass
+
+    def start_document(self):
+        pass
+
+    def end_document(self, oNFe, nItems):
+        pass
+
+    def end_batch(self):
+        pass
+
+
 class Danfe(object):
     def __init__(
         self,
@@ -122,15 +391,12 @@ class Danfe(object):
         logo=None,
         cce_xml=None,
         timezone=None,
+        list_logo=None,
+        fileObj=None,
+        profiler=None,
+        list_cce=None,
     ):
-        tamanho_ocupado = 0
-        path = os.path.join(os.path.dirname(__file__), "fonts")
-        pdfmetrics.registerFont(
-            TTFont("NimbusSanL-Regu", os.path.join(path, "NimbusSanL Regular.ttf"))
-        )
-        pdfmetrics.registerFont(
-            TTFont("NimbusSanL-Bold", os.path.join(path, "NimbusSanL Bold.ttf"))
-        )
+        register_fonts()
         self.width = 210  # 21 x 29,7cm
         self.height = 297
         self.nLeft = 10
@@ -139,6 +405,7 @@ class Danfe(object):
         self.nBottom = 8
         self.nlin = self.nTop
         self.logo = logo
+        self.frames = set()
         self.oFrete = {
             "0": "0 - Contratação por conta do Remetente (CIF)",
             "1": "1 - Contratação por conta do Destinatário (FOB)",
@@ -148,7 +415,9 @@ class Danfe(object):
             "9": "9 - Sem Ocorrência de Transporte",
         }
 
-        self.oPDF_IO = BytesIO()
+        # Com fileObj o PDF é gravado direto no arquivo do chamador, sem
+        # passar por um buffer intermediário
+        self.oPDF_IO = fileObj if fileObj is not None else BytesIO()
         if orientation == "landscape":
             raise NameError("Rotina não implementada")
         else:
@@ -158,95 +427,150 @@ class Danfe(object):
         self.canvas.setTitle("DANFE")
         self.canvas.setStrokeColor(black)
 
-        for oXML in list_xml:
-            oXML_cobr = oXML.find(".//{http://www.portalfiscal.inf.br/nfe}cobr")
-
-            self.NrPages = 1
-            self.Page = 1
-
-            el_det = oXML.findall(".//{http://www.portalfiscal.inf.br/nfe}det")
-
-            # Declaring variable to prevent future errors
-            _nId = 0
+        profiler = profiler or _NullProfiler()
+        profiler.instrument(self)
 
-            if el_det is not None:
-                list_desc = []
-                list_cod_prod = []
+        for nDoc, oXML in enumerate(list_xml):
+            profiler.start_document()
 
-                for _nId, item in enumerate(el_det):
-                    el_prod = item.find(".//{http://www.portalfiscal.inf.br/nfe}prod")
-                    infAdProd = item.find(
-                        ".//{http://www.portalfiscal.inf.br/nfe}infAdProd"
-                    )
+            # Logo por documento, permite imprimir notas de empresas diferentes
+            # na mesma execução
+            if list_logo is not None:
+                self.logo = list_logo[nDoc]
 
-                    list_ = wrap(tagtext(oNode=el_prod, cTag="xProd"), 50)
-                    if infAdProd is not None:
-                        list_.extend(wrap(infAdProd.text, 50))
-                    list_desc.append(list_)
+            oNFe, self.NrPages, iter_page = self.plan_document(oXML)
+            self.Page = 1
 
-                    list_cProd = wrap(tagtext(oNode=el_prod, cTag="cProd"), 14)
-                    list_cod_prod.append(list_cProd)
+            tamanho_ocupado = 0
 
-                # Calculando nr. aprox. de páginas
-                if _nId > 25:
-                    self.NrPages += math.ceil((_nId - 25) / 70)
+            self.bookmark(oNFe=oNFe, nDoc=nDoc)
 
             if recibo:
-                self.recibo_entrega(oXML=oXML, timezone=timezone)
+                self.recibo_entrega(oNFe=oNFe, timezone=timezone)
 
-            self.ide_emit(oXML=oXML, timezone=timezone)
-            self.destinatario(oXML=oXML, timezone=timezone)
-            tamanho_ocupado += self.entrega_retirada(oXML=oXML, timezone=timezone)
+            self.ide_emit(oNFe=oNFe, timezone=timezone)
+            self.destinatario(oNFe=oNFe, timezone=timezone)
+            tamanho_ocupado += self.entrega_retirada(oNFe=oNFe, timezone=timezone)
 
-            if oXML_cobr is not None:
-                self.faturas(oXML=oXML_cobr, timezone=timezone)
+            if oNFe.cobr is not None:
+                self.faturas(oNFe=oNFe, timezone=timezone)
 
-            self.impostos(oXML=oXML)
-            self.transportes(oXML=oXML)
+            self.impostos(oNFe=oNFe)
+            self.transportes(oNFe=oNFe)
 
-            index = self.produtos(
-                oXML=oXML,
-                el_det=el_det,
-                max_index=_nId,
-                list_desc=list_desc,
-                list_cod_prod=list_cod_prod,
-            )
+            # Itens contados à medida que as páginas são lidas, a NFeData de
+            # uma NFeStream não guarda os itens
+            list_row = next(iter_page)
+            nItems = len(list_row)
+            self.produtos(list_row=list_row)
 
-            tamanho_ocupado += self.calculo_issqn(oXML=oXML)
-            self.adicionais(oXML=oXML, tamanho_diminuir=tamanho_ocupado)
+            tamanho_ocupado += self.calculo_issqn(oNFe=oNFe)
+            self.adicionais(oNFe=oNFe, tamanho_diminuir=tamanho_ocupado)
 
             # Gera o restante das páginas do XML
-            while index < _nId:
-                if index < 0:
-                    index = index * -1
+            for list_row in iter_page:
+                nItems += len(list_row)
                 self.newpage()
-                self.ide_emit(oXML=oXML, timezone=timezone)
-                index = self.produtos(
-                    oXML=oXML,
-                    el_det=el_det,
-                    index=index,
-                    max_index=_nId,
-                    list_desc=list_desc,
-                    nHeight=77,
-                    list_cod_prod=list_cod_prod,
+                # Moldura das páginas de continuação desenhada uma vez por
+                # nota e reaproveitada em cada página
+                self.canvas.doForm(
+                    self.continuation_frame(oNFe=oNFe, nDoc=nDoc, timezone=timezone)
+                )
+                self.ide_emit(oNFe=oNFe, timezone=timezone, draw_frame=False)
+                self.produtos(
+                    list_row=list_row,
+                    nHeight=PRODUCT_LINES_NEXT_PAGE,
+                    draw_frame=False,
                 )
 
             self.newpage()
+
+            # Cartas de correção da nota, logo após o seu DANFE
+            for xml in list_cce[nDoc] if list_cce else ():
+                self._generate_cce(cce_xml=xml, oNFe=oNFe, timezone=timezone)
+                self.newpage()
+            profiler.end_document(oNFe, nItems)
         if cce_xml:
             for xml in cce_xml:
-                self._generate_cce(cce_xml=xml, oXML=oXML, timezone=timezone)
+                self._generate_cce(cce_xml=xml, oNFe=oNFe, timezone=timezone)
                 self.newpage()
         self.canvas.save()
+        profiler.end_batch()
+
+    def plan_document(self, oXML):
+        """Lê a nota e distribui os itens pelas páginas antes de desenhar, o
+        total de páginas já sai exato.
+
+        Uma NFeStream é lida duas vezes: na primeira só as quebras de página
+        são guardadas, na segunda as linhas de cada página são formatadas
+        enquanto ela é desenhada.
+
+        :return: (NFeData, nr. de páginas, iterador com as linhas de cada
+            página)
+        """
+        if isinstance(oXML, NFeStream):
+            list_size = plan_page_sizes(
+                ItemRow(item).nLines for item in oXML.iter_items()
+            )
+            iter_row = (ItemRow(item) for item in oXML.iter_items())
+            iter_page = (list(islice(iter_row, nCount)) for nCount in list_size)
+            return oXML.data, len(list_size), iter_page
+
+        # O XML é percorrido uma única vez, as seções leem da NFeData
+        oNFe = NFeData(oXML)
+        list_page = plan_pages([ItemRow(item) for item in oNFe.items])
+        return oNFe, len(list_page), iter(list_page)
+
+    def continuation_frame(self, oNFe=None, nDoc=0, timezone=None):
+        """Cria, na primeira chamada para a nota, o form XObject com a parte
+        fixa das páginas de continuação: cabeçalho do emitente e quadro de
+        produtos sem os itens.
+
+        :return: nome do form, para uso no canvas.doForm
+        """
+        cName = "danfe_frame_%s" % nDoc
+        if cName not in self.frames:
+            nlin = self.nlin
+            self.canvas.beginForm(cName)
+            self.ide_emit_frame(oNFe=oNFe, timezone=timezone)
+            self.nlin += 48 + 1
+            self.produtos_frame(nH=7.5 + (77 * 2.5))
+            self.canvas.endForm()
+            self.nlin = nlin
+            self.frames.add(cName)
+        return cName
+
+    def bookmark(self, oNFe=None, nDoc=0):
+        # Marcador no PDF para cada nota, preservado quando os PDFs gerados
+        # em paralelo são unidos
+        cKey = "danfe_%s" % nDoc
+        self.canvas.bookmarkPage(cKey)
+        self.canvas.addOutlineEntry(
+            "NF-e %s - Série %s" % (oNFe.ide["nNF"], oNFe.ide["serie"]),
+            cKey,
+            level=0,
+        )
+
+    def ide_emit(self, oNFe=None, timezone=None, draw_frame=True):
+        self.canvas.setLineWidth(0.5)
+        if draw_frame:
+            self.ide_emit_frame(oNFe=oNFe, timezone=timezone)
 
-    def ide_emit(self, oXML=None, timezone=None):
-        elem_infNFe = oXML.find(".//{http://www.portalfiscal.inf.br/nfe}infNFe")
-        elem_protNFe = oXML.find(".//{http://www.portalfiscal.inf.br/nfe}protNFe")
-        elem_emit = oXML.find(".//{http://www.portalfiscal.inf.br/nfe}emit")
-        elem_ide = oXML.find(".//{http://www.portalfiscal.inf.br/nfe}ide")
-        elem_evento = oXML.find(".//{http://www.portalfiscal.inf.br/nfe}infEvento")
+        # Único conteúdo do cabeçalho que muda entre as páginas da nota
+        self.canvas.setFont("NimbusSanL-Bold", 8)
+        cPag = "Página %s de %s" % (str(self.Page), str(self.NrPages))
+        self.stringcenter(self.nLeft + 100, self.nlin + 32, cPag)
 
-        cChave = elem_infNFe.attrib.get("Id")[3:]
-        barcode128 = code128.Code128(cChave, barHeight=10 * mm, barWidth=0.25 * mm)
+        self.nlin += 48
+
+    def ide_emit_frame(self, oNFe=None, timezone=None):
+        elem_protNFe = oNFe.prot
+        elem_emit = oNFe.emit
+        elem_ide = oNFe.ide
+        elem_evento = oNFe.evento
+
+        cChave = oNFe.chave
+        barcode128 = get_barcode(cChave)
 
         self.canvas.setLineWidth(0.5)
         self.rect(self.nLeft, self.nlin + 1, self.nLeft + 75, 32)
@@ -274,21 +598,17 @@ class Danfe(object):
         # Labels
         self.canvas.setFont("NimbusSanL-Bold", 12)
         self.stringcenter(self.nLeft + 98, self.nlin + 5, "DANFE")
-        self.stringcenter(
-            self.nLeft + 109, self.nlin + 19.5, tagtext(oNode=elem_ide, cTag="tpNF")
-        )
+        self.stringcenter(self.nLeft + 109, self.nlin + 19.5, elem_ide["tpNF"])
         self.canvas.setFont("NimbusSanL-Bold", 8)
-        cNF = tagtext(oNode=elem_ide, cTag="nNF")
+        cNF = elem_ide["nNF"]
         cNF = "{:011,}".format(int(cNF)).replace(",", ".")
         self.stringcenter(self.nLeft + 100, self.nlin + 25, "Nº %s" % (cNF))
 
         self.stringcenter(
             self.nLeft + 100,
             self.nlin + 29,
-            "SÉRIE %s" % (tagtext(oNode=elem_ide, cTag="serie")),
+            "SÉRIE %s" % (elem_ide["serie"]),
         )
-        cPag = "Página %s de %s" % (str(self.Page), str(self.NrPages))
-        self.stringcenter(self.nLeft + 100, self.nlin + 32, cPag)
         self.canvas.setFont("NimbusSanL-Regu", 6)
         self.string(self.nLeft + 86, self.nlin + 8, "Documento Auxiliar da")
         self.string(self.nLeft + 86, self.nlin + 10.5, "Nota Fiscal Eletrônica")
@@ -330,22 +650,18 @@ class Danfe(object):
             self.nLeft + 116.5 + nW_Rect, self.nlin + 19.5, " ".join(chunks(cChave, 4))
         )  # Chave
         self.canvas.setFont("NimbusSanL-Regu", 8)
-        cDt, cHr = getdateByTimezone(
-            tagtext(oNode=elem_protNFe, cTag="dhRecbto"), timezone
-        )
-        cProtocolo = tagtext(oNode=elem_protNFe, cTag="nProt")
+        cDt, cHr = getdateByTimezone(elem_protNFe["dhRecbto"], timezone)
+        cProtocolo = elem_protNFe["nProt"]
         cDt = cProtocolo + " - " + cDt + " " + cHr
         nW_Rect = (self.width - self.nLeft - self.nRight - 110) / 2
         self.stringcenter(self.nLeft + 115 + nW_Rect, self.nlin + 38.7, cDt)
         self.canvas.setFont("NimbusSanL-Regu", 8)
-        self.string(
-            self.nLeft + 1, self.nlin + 38.7, tagtext(oNode=elem_ide, cTag="natOp")
-        )
-        self.string(self.nLeft + 1, self.nlin + 46, tagtext(oNode=elem_emit, cTag="IE"))
+        self.string(self.nLeft + 1, self.nlin + 38.7, elem_ide["natOp"])
+        self.string(self.nLeft + 1, self.nlin + 46, elem_emit["IE"])
         self.string(
             self.nLeft + 101,
             self.nlin + 46,
-            format_cnpj_cpf(tagtext(oNode=elem_emit, cTag="CNPJ")),
+            format_cnpj_cpf(elem_emit["CNPJ"]),
         )
 
         styles = getSampleStyleSheet()
@@ -355,7 +671,7 @@ class Danfe(object):
         styleN.alignment = TA_CENTER
 
         # Razão Social emitente
-        P = Paragraph(tagtext(oNode=elem_emit, cTag="xNome"), styleN)
+        P = Paragraph(elem_emit["xNome"], styleN)
         w, h = P.wrap(55 * mm, 40 * mm)
         P.drawOn(
             self.canvas,
@@ -364,32 +680,18 @@ class Danfe(object):
         )
 
         if self.logo:
-            img = get_image(self.logo, width=2 * cm)
+            img = get_image(self.logo, width=LOGO_WIDTH)
             img.drawOn(
                 self.canvas, (self.nLeft + 5) * mm, (self.height - self.nlin - 22) * mm
             )
 
-        cEnd = (
-            tagtext(oNode=elem_emit, cTag="xLgr")
-            + ", "
-            + tagtext(oNode=elem_emit, cTag="nro")
-            + " - "
-        )
-        cEnd += tagtext(oNode=elem_emit, cTag="xCpl") + " - "
-        cEnd += (
-            tagtext(oNode=elem_emit, cTag="xBairro")
-            + "<br />"
-            + tagtext(oNode=elem_emit, cTag="xMun")
-            + " - "
-        )
-        cEnd += "Fone: " + tagtext(oNode=elem_emit, cTag="fone") + "<br />"
-        cEnd += (
-            tagtext(oNode=elem_emit, cTag="UF")
-            + " - "
-            + tagtext(oNode=elem_emit, cTag="CEP")
-        )
+        cEnd = elem_emit["xLgr"] + ", " + elem_emit["nro"] + " - "
+        cEnd += elem_emit["xCpl"] + " - "
+        cEnd += elem_emit["xBairro"] + "<br />" + elem_emit["xMun"] + " - "
+        cEnd += "Fone: " + elem_emit["fone"] + "<br />"
+        cEnd += elem_emit["UF"] + " - " + elem_emit["CEP"]
 
-        regime = tagtext(oNode=elem_emit, cTag="CRT")
+        regime = elem_emit["CRT"]
         cEnd += "<br />Regime Tributário: %s" % (REGIME_TRIBUTACAO[regime])
 
         styleN.fontName = "NimbusSanL-Regu"
@@ -402,7 +704,7 @@ class Danfe(object):
         )
 
         # Homologação
-        if tagtext(oNode=elem_ide, cTag="tpAmb") == "2":
+        if elem_ide["tpAmb"] == "2":
             self.canvas.saveState()
             self.canvas.rotate(90)
             self.canvas.setFont("Times-Bold", 40)
@@ -411,7 +713,7 @@ class Danfe(object):
             self.canvas.restoreState()
 
         # Cancelado
-        if tagtext(oNode=elem_evento, cTag="cStat") in ("135", "155"):
+        if elem_evento["cStat"] in ("135", "155"):
             self.canvas.saveState()
             self.canvas.rotate(45)
             self.canvas.setFont("NimbusSanL-Bold", 60)
@@ -419,11 +721,9 @@ class Danfe(object):
             self.string(self.nLeft + 80, 275, "CANCELADO")
             self.canvas.restoreState()
 
-        self.nlin += 48
-
-    def destinatario(self, oXML=None, timezone=None):
-        elem_ide = oXML.find(".//{http://www.portalfiscal.inf.br/nfe}ide")
-        elem_dest = oXML.find(".//{http://www.portalfiscal.inf.br/nfe}dest")
+    def destinatario(self, oNFe=None, timezone=None):
+        elem_ide = oNFe.ide
+        elem_dest = oNFe.dest
         nMr = self.width - self.nRight
 
         self.nlin += 1
@@ -456,23 +756,21 @@ class Danfe(object):
         self.string(nMr - 24, self.nlin + 17.1, "HORA DE ENTRADA/SAÍDA")
         # Conteúdo campos
         self.canvas.setFont("NimbusSanL-Regu", 8)
-        self.string(
-            self.nLeft + 1, self.nlin + 7.5, tagtext(oNode=elem_dest, cTag="xNome")
-        )
-        cnpj_cpf = tagtext(oNode=elem_dest, cTag="CNPJ")
+        self.string(self.nLeft + 1, self.nlin + 7.5, elem_dest["xNome"])
+        cnpj_cpf = elem_dest["CNPJ"]
         if cnpj_cpf:
             cnpj_cpf = format_cnpj_cpf(cnpj_cpf)
         else:
-            cnpj_cpf = format_cnpj_cpf(tagtext(oNode=elem_dest, cTag="CPF"))
+            cnpj_cpf = format_cnpj_cpf(elem_dest["CPF"])
         self.string(nMr - 69, self.nlin + 7.5, cnpj_cpf)
-        cDt, cHr = getdateByTimezone(tagtext(oNode=elem_ide, cTag="dhEmi"), timezone)
+        cDt, cHr = getdateByTimezone(elem_ide["dhEmi"], timezone)
         self.string(nMr - 24, self.nlin + 7.7, cDt + " " + cHr)
-        cDt, cHr = getdateByTimezone(tagtext(oNode=elem_ide, cTag="dhSaiEnt"), timezone)
+        cDt, cHr = getdateByTimezone(elem_ide["dhSaiEnt"], timezone)
         self.string(nMr - 24, self.nlin + 14.3, cDt + " " + cHr)  # Dt saída
         cEnd = "%s, %s %s" % (
-            tagtext(oNode=elem_dest, cTag="xLgr"),
-            tagtext(oNode=elem_dest, cTag="nro"),
-            tagtext(oNode=elem_dest, cTag="xCpl"),
+            elem_dest["xLgr"],
+            elem_dest["nro"],
+            elem_dest["xCpl"],
         )
         if len(cEnd) > 52:
             self.canvas.setFont("NimbusSanL-Regu", 6)
@@ -481,30 +779,26 @@ class Danfe(object):
             self.canvas.setFont("NimbusSanL-Regu", 8)
         else:
             self.string(self.nLeft + 1, self.nlin + 14.3, cEnd)
-        self.string(
-            nMr - 98, self.nlin + 14.3, tagtext(oNode=elem_dest, cTag="xBairro")
-        )
-        self.string(nMr - 52, self.nlin + 14.3, tagtext(oNode=elem_dest, cTag="CEP"))
-        self.string(
-            self.nLeft + 1, self.nlin + 21.1, tagtext(oNode=elem_dest, cTag="xMun")
-        )
-        self.string(nMr - 135, self.nlin + 21.1, tagtext(oNode=elem_dest, cTag="fone"))
-        self.string(nMr - 101, self.nlin + 21.1, tagtext(oNode=elem_dest, cTag="UF"))
-        self.string(nMr - 89, self.nlin + 21.1, tagtext(oNode=elem_dest, cTag="IE"))
+        self.string(nMr - 98, self.nlin + 14.3, elem_dest["xBairro"])
+        self.string(nMr - 52, self.nlin + 14.3, elem_dest["CEP"])
+        self.string(self.nLeft + 1, self.nlin + 21.1, elem_dest["xMun"])
+        self.string(nMr - 135, self.nlin + 21.1, elem_dest["fone"])
+        self.string(nMr - 101, self.nlin + 21.1, elem_dest["UF"])
+        self.string(nMr - 89, self.nlin + 21.1, elem_dest["IE"])
 
         self.nlin += 24  # Nr linhas ocupadas pelo bloco
 
-    def entrega_retirada(self, oXML=None, timezone=None):
-        elem_entrega = oXML.find(".//{http://www.portalfiscal.inf.br/nfe}entrega")
-        elem_retirada = oXML.find(".//{http://www.portalfiscal.inf.br/nfe}retirada")
+    def entrega_retirada(self, oNFe=None, timezone=None):
+        elem_entrega = oNFe.entrega
+        elem_retirada = oNFe.retirada
         self.canvas.setFont("NimbusSanL-Bold", 7)
 
-        if elem_entrega is not None and len(elem_entrega):
+        if elem_entrega:
             elem = elem_entrega
             self.string(
                 self.nLeft + 1, self.nlin + 1, "INFORMAÇÕES DO LOCAL DE ENTREGA"
             )
-        elif elem_retirada is not None and len(elem_retirada):
+        elif elem_retirada:
             elem = elem_retirada
             self.string(
                 self.nLeft + 1, self.nlin + 1, "INFORMAÇÕES DO LOCAL DE RETIRADA"
@@ -538,30 +832,30 @@ class Danfe(object):
         self.string(nMr - 36, self.nlin + 17.1, "UF")
         # Conteúdo campos
         self.canvas.setFont("NimbusSanL-Regu", 8)
-        self.string(self.nLeft + 1, self.nlin + 7.5, tagtext(oNode=elem, cTag="xNome"))
-        cnpj_cpf = tagtext(oNode=elem, cTag="CNPJ")
+        self.string(self.nLeft + 1, self.nlin + 7.5, elem["xNome"])
+        cnpj_cpf = elem["CNPJ"]
         if cnpj_cpf:
             cnpj_cpf = format_cnpj_cpf(cnpj_cpf)
         else:
-            cnpj_cpf = format_cnpj_cpf(tagtext(oNode=elem, cTag="CPF"))
+            cnpj_cpf = format_cnpj_cpf(elem["CPF"])
         self.string(nMr - 69, self.nlin + 7.5, cnpj_cpf)
-        self.string(nMr - 24, self.nlin + 7.5, tagtext(oNode=elem, cTag="IE"))
+        self.string(nMr - 24, self.nlin + 7.5, elem["IE"])
         cEnd = "%s, %s %s" % (
-            tagtext(oNode=elem, cTag="xLgr"),
-            tagtext(oNode=elem, cTag="nro"),
-            tagtext(oNode=elem, cTag="xCpl"),
+            elem["xLgr"],
+            elem["nro"],
+            elem["xCpl"],
         )
         self.string(self.nLeft + 1, self.nlin + 14.3, cEnd)
-        self.string(nMr - 89, self.nlin + 14.3, tagtext(oNode=elem, cTag="xBairro"))
-        self.string(nMr - 24, self.nlin + 14.3, tagtext(oNode=elem, cTag="CEP"))
-        self.string(self.nLeft + 1, self.nlin + 21.1, tagtext(oNode=elem, cTag="xMun"))
-        self.string(nMr - 36, self.nlin + 21.1, tagtext(oNode=elem, cTag="UF"))
-        self.string(nMr - 24, self.nlin + 21.1, tagtext(oNode=elem, cTag="fone"))
+        self.string(nMr - 89, self.nlin + 14.3, elem["xBairro"])
+        self.string(nMr - 24, self.nlin + 14.3, elem["CEP"])
+        self.string(self.nLeft + 1, self.nlin + 21.1, elem["xMun"])
+        self.string(nMr - 36, self.nlin + 21.1, elem["UF"])
+        self.string(nMr - 24, self.nlin + 21.1, elem["fone"])
 
         self.nlin += 24  # Nr linhas ocupadas pelo bloco
         return 24
 
-    def faturas(self, oXML=None, timezone=None):
+    def faturas(self, oNFe=None, timezone=None):
         nMr = self.width - self.nRight
 
         self.canvas.setFont("NimbusSanL-Bold", 7)
@@ -594,21 +888,19 @@ class Danfe(object):
         nCol = 0
         nAju = 0
 
-        line_iter = iter(oXML[1:10])  # Salta elemt 1 e considera os próximos 9
-        for oXML_dup in line_iter:
-            cDt, cHr = getdateByTimezone(
-                tagtext(oNode=oXML_dup, cTag="dVenc"), timezone
-            )
+        line_iter = iter(oNFe.cobr[1:10])  # Salta elemt 1 e considera os próximos 9
+        for oDup in line_iter:
+            cDt, cHr = getdateByTimezone(oDup["dVenc"], timezone)
             self.string(
                 self.nLeft + nCol + 1,
                 self.nlin + nLin,
-                tagtext(oNode=oXML_dup, cTag="nDup"),
+                oDup["nDup"],
             )
             self.string(self.nLeft + nCol + 17, self.nlin + nLin, cDt)
             self.stringRight(
                 self.nLeft + nCol + 47,
                 self.nlin + nLin,
-                format_number(tagtext(oNode=oXML_dup, cTag="vDup")),
+                format_number(oDup["vDup"]),
             )
 
             if nPar == 3:
@@ -622,30 +914,17 @@ class Danfe(object):
                 nPar += 1
 
         # Campos adicionais XML - Condicionados a existencia de financeiro
-        elem_infAdic = oXML.getparent().find(
-            ".//{http://www.portalfiscal.inf.br/nfe}infAdic"
-        )
-        if elem_infAdic is not None:
-            codvend = elem_infAdic.find(
-                ".//{http://www.portalfiscal.inf.br/nfe}obsCont\
-[@xCampo='CodVendedor']"
-            )
-            self.string(
-                nMr - 46.5, self.nlin + 7.7, tagtext(oNode=codvend, cTag="xTexto")
-            )
-            vend = elem_infAdic.find(
-                ".//{http://www.portalfiscal.inf.br/nfe}\
-obsCont[@xCampo='NomeVendedor']"
-            )
-            self.string(
-                nMr - 46.5, self.nlin + 14.3, tagtext(oNode=vend, cTag="xTexto")[:36]
-            )
+        if oNFe.infAdic:
+            codvend = oNFe.obs_cont.get("CodVendedor", "")
+            self.string(nMr - 46.5, self.nlin + 7.7, codvend)
+            vend = oNFe.obs_cont.get("NomeVendedor", "")
+            self.string(nMr - 46.5, self.nlin + 14.3, vend[:36])
 
         self.nlin += 16  # Nr linhas ocupadas pelo bloco
 
-    def impostos(self, oXML=None):
+    def impostos(self, oNFe=None):
         # Impostos
-        el_total = oXML.find(".//{http://www.portalfiscal.inf.br/nfe}total")
+        el_total = oNFe.total
         nMr = self.width - self.nRight
         self.nlin += 1
         self.canvas.setFont("NimbusSanL-Bold", 7)
@@ -683,69 +962,69 @@ obsCont[@xCampo='NomeVendedor']"
         self.stringRight(
             self.nLeft + 34,
             self.nlin + 7.7,
-            format_number(tagtext(oNode=el_total, cTag="vBC")),
+            format_number(el_total["vBC"]),
         )
         self.stringRight(
             self.nLeft + 64,
             self.nlin + 7.7,
-            format_number(tagtext(oNode=el_total, cTag="vICMS")),
+            format_number(el_total["vICMS"]),
         )
         self.stringRight(
             self.nLeft + 94,
             self.nlin + 7.7,
-            format_number(tagtext(oNode=el_total, cTag="vBCST")),
+            format_number(el_total["vBCST"]),
         )
         self.stringRight(
             nMr - 66,
             self.nlin + 7.7,
-            format_number(tagtext(oNode=el_total, cTag="vST")),
+            format_number(el_total["vST"]),
         )
         self.stringRight(
             nMr - 36,
             self.nlin + 7.7,
-            format_number(tagtext(oNode=el_total, cTag="vTotTrib")),
+            format_number(el_total["vTotTrib"]),
         )
         self.stringRight(
             nMr - 1,
             self.nlin + 7.7,
-            format_number(tagtext(oNode=el_total, cTag="vProd")),
+            format_number(el_total["vProd"]),
         )
         self.stringRight(
             self.nLeft + 34,
             self.nlin + 14.1,
-            format_number(tagtext(oNode=el_total, cTag="vFrete")),
+            format_number(el_total["vFrete"]),
         )
         self.stringRight(
             self.nLeft + 64,
             self.nlin + 14.1,
-            format_number(tagtext(oNode=el_total, cTag="vSeg")),
+            format_number(el_total["vSeg"]),
         )
         self.stringRight(
             self.nLeft + 94,
             self.nlin + 14.1,
-            format_number(tagtext(oNode=el_total, cTag="vDesc")),
+            format_number(el_total["vDesc"]),
         )
         self.stringRight(
             self.nLeft + 124,
             self.nlin + 14.1,
-            format_number(tagtext(oNode=el_total, cTag="vOutro")),
+            format_number(el_total["vOutro"]),
         )
         self.stringRight(
             self.nLeft + 154,
             self.nlin + 14.1,
-            format_number(tagtext(oNode=el_total, cTag="vIPI")),
+            format_number(el_total["vIPI"]),
         )
         self.stringRight(
             nMr - 1,
             self.nlin + 14.1,
-            format_number(tagtext(oNode=el_total, cTag="vNF")),
+            format_number(el_total["vNF"]),
         )
 
         self.nlin += 17  # Nr linhas ocupadas pelo bloco
 
-    def transportes(self, oXML=None):
-        el_transp = oXML.find(".//{http://www.portalfiscal.inf.br/nfe}transp")
-        veic_transp = oXML.find(".//{http://www.portalfiscal.inf.br/nfe}veicTransp")
+    def transportes(self, oNFe=None):
+        el_transp = oNFe.transp
+        veic_transp = oNFe.veic_transp
         nMr = self.width - self.nRight
 
         self.canvas.setFont("NimbusSanL-Bold", 7)
@@ -786,81 +1065,116 @@ obsCont[@xCampo='NomeVendedor']"
         self.string(self.nLeft + 1, self.nlin + 17, "QUANTIDADE")
         # Conteúdo campos
         self.canvas.setFont("NimbusSanL-Regu", 7)
-        self.string(
-            self.nLeft + 1, self.nlin + 7.7, tagtext(oNode=el_transp, cTag="xNome")[:42]
-        )
+        self.string(self.nLeft + 1, self.nlin + 7.7, el_transp["xNome"][:42])
         self.string(
             self.nLeft + 68,
             self.nlin + 7.7,
-            self.oFrete[tagtext(oNode=el_transp, cTag="modFrete")],
-        )
-        self.string(
-            self.nLeft + 122, self.nlin + 7.7, tagtext(oNode=el_transp, cTag="RNTC")
-        )
-        self.string(
-            self.nLeft + 136, self.nlin + 7.7, tagtext(oNode=el_transp, cTag="placa")
-        )
-        self.string(
-            self.nLeft + 157, self.nlin + 7.7, tagtext(oNode=veic_transp, cTag="UF")
+            self.oFrete[el_transp["modFrete"]],
         )
+        self.string(self.nLeft + 122, self.nlin + 7.7, el_transp["RNTC"])
+        self.string(self.nLeft + 136, self.nlin + 7.7, el_transp["placa"])
+        self.string(self.nLeft + 157, self.nlin + 7.7, veic_transp["UF"])
         self.string(
             nMr - 25,
             self.nlin + 7.7,
-            format_cnpj_cpf(tagtext(oNode=el_transp, cTag="CNPJ")),
+            format_cnpj_cpf(el_transp["CNPJ"]),
         )
         self.canvas.setFont("NimbusSanL-Regu", 8)
         self.string(
             self.nLeft + 1,
             self.nlin + 14.2,
-            tagtext(oNode=el_transp, cTag="xEnder")[:45],
-        )
-        self.string(
-            self.nLeft + 89, self.nlin + 14.2, tagtext(oNode=el_transp, cTag="xMun")
-        )
-        self.string(nMr - 32, self.nlin + 14.2, tagtext(oNode=el_transp, cTag="UF"))
-        self.string(nMr - 25, self.nlin + 14.2, tagtext(oNode=el_transp, cTag="IE"))
-        self.string(
-            self.nLeft + 1, self.nlin + 21.2, tagtext(oNode=el_transp, cTag="qVol")
-        )
-        self.string(
-            self.nLeft + 31, self.nlin + 21.2, tagtext(oNode=el_transp, cTag="esp")
-        )
-        self.string(
-            self.nLeft + 70, self.nlin + 21.2, tagtext(oNode=el_transp, cTag="marca")
-        )
-        self.string(
-            self.nLeft + 106, self.nlin + 21.2, tagtext(oNode=el_transp, cTag="nVol")
-        )
+            el_transp["xEnder"][:45],
+        )
+        self.string(self.nLeft + 89, self.nlin + 14.2, el_transp["xMun"])
+        self.string(nMr - 32, self.nlin + 14.2, el_transp["UF"])
+        self.string(nMr - 25, self.nlin + 14.2, el_transp["IE"])
+        self.string(self.nLeft + 1, self.nlin + 21.2, el_transp["qVol"])
+        self.string(self.nLeft + 31, self.nlin + 21.2, el_transp["esp"])
+        self.string(self.nLeft + 70, self.nlin + 21.2, el_transp["marca"])
+        self.string(self.nLeft + 106, self.nlin + 21.2, el_transp["nVol"])
         self.stringRight(
             nMr - 27,
             self.nlin + 21.2,
-            format_number(tagtext(oNode=el_transp, cTag="pesoB")),
+            format_number(el_transp["pesoB"]),
         )
         self.stringRight(
             nMr - 1,
             self.nlin + 21.2,
-            format_number(tagtext(oNode=el_transp, cTag="pesoL")),
+            format_number(el_transp["pesoL"]),
         )
 
         self.nlin += 23
 
     def produtos(
         self,
-        oXML=None,
-        el_det=None,
-        index=0,
-        max_index=0,
-        list_desc=None,
-        list_cod_prod=None,
-        nHeight=29,
+        list_row=None,
+        nHeight=PRODUCT_LINES_FIRST_PAGE,
+        draw_frame=True,
     ):
+        """Desenha as linhas de uma página, já distribuídas por plan_pages."""
         nMr = self.width - self.nRight
         nStep = 2.5  # Passo entre linhas
         nH = 7.5 + (nHeight * nStep)  # cabeçalho 7.5
         self.nlin += 1
-        # nH é o altura da linha vertical, utilizar como referência
-        # somar a ele a altura atual que é nlin
-        maxHeight = self.nlin + nH
+
+        if draw_frame:
+            self.produtos_frame(nH=nH)
+
+        # Conteúdo campos
+        self.canvas.setFont("NimbusSanL-Regu", 5)
+        nLin = self.nlin + 10.0
+
+        for row in list_row or []:
+            (
+                cNCM,
+                cCST,
+                cCFOP,
+                cUnid,
+                cQtd,
+                cVlrUnit,
+                cVlrTotal,
+                cBC,
+                cVlrICMS,
+                cAliqICMS,
+                cVlrIPI,
+                cAliqIPI,
+            ) = row.cells
+
+            self.stringcenter(nMr - 112.5, nLin, cNCM)
+            self.stringcenter(nMr - 105, nLin, cCST)
+            self.stringcenter(nMr - 99, nLin, cCFOP)
+            self.stringcenter(nMr - 93, nLin, cUnid)
+            self.stringRight(nMr - 78.5, nLin, cQtd)
+            self.stringRight(nMr - 64.5, nLin, cVlrUnit)
+            self.stringRight(nMr - 50.5, nLin, cVlrTotal)
+            self.stringRight(nMr - 38.5, nLin, cBC)
+            self.stringRight(nMr - 26.5, nLin, cVlrICMS)
+            self.stringRight(nMr - 7.5, nLin, cAliqICMS)
+
+            self.stringRight(nMr - 14.5, nLin, cVlrIPI)
+            self.stringRight(nMr - 0.5, nLin, cAliqIPI)
+
+            # Código Item
+            line_cod = nLin
+            for des in row.list_cod:
+                self.string(self.nLeft + 0.2, line_cod, des)
+                line_cod += nStep
+
+            # Descrição Item
+            line_desc = nLin
+            for des in row.list_desc:
+                self.string(self.nLeft + 15.5, line_desc, des)
+                line_desc += nStep
+
+            nLin = max(line_cod, line_desc)
+            self.canvas.setStrokeColor(gray)
+            self.hline(self.nLeft, nLin - 2, self.width - self.nLeft)
+            self.canvas.setStrokeColor(black)
+
+        self.nlin += nH + 3
+
+    def produtos_frame(self, nH):
+        nMr = self.width - self.nRight
 
         self.canvas.setFont("NimbusSanL-Bold", 7)
         self.string(self.nLeft + 1, self.nlin + 1, "DADOS DO PRODUTO/SERVIÇO")
@@ -902,78 +1216,9 @@ obsCont[@xCampo='NomeVendedor']"
         nCol_ = self.nLeft + 20 + (nWidth_Prod / 2)
         self.stringcenter(nCol_, self.nlin + 5.5, "DESCRIÇÃO DO PRODUTO/SERVIÇO")
 
-        # Conteúdo campos
-        self.canvas.setFont("NimbusSanL-Regu", 5)
-        nLin = self.nlin + 10.0
-
-        for id in range(index, max_index + 1):
-            line_height = max(len(list_cod_prod[id]), len(list_desc[id]))
-            line_height *= nStep
-            if nLin + line_height > maxHeight:
-                id = id * -1
-                break
-
-            item = el_det[id]
-            el_prod = item.find(".//{http://www.portalfiscal.inf.br/nfe}prod")
-            el_imp = item.find(".//{http://www.portalfiscal.inf.br/nfe}imposto")
-
-            el_imp_ICMS = el_imp.find(".//{http://www.portalfiscal.inf.br/nfe}ICMS")
-            el_imp_IPI = el_imp.find(".//{http://www.portalfiscal.inf.br/nfe}IPI")
-            cCST = tagtext(oNode=el_imp_ICMS, cTag="orig") + (
-                tagtext(oNode=el_imp_ICMS, cTag="CST")
-                or tagtext(oNode=el_imp_ICMS, cTag="CSOSN")
-            )
-            vBC = tagtext(oNode=el_imp_ICMS, cTag="vBC")
-            vICMS = tagtext(oNode=el_imp_ICMS, cTag="vICMS")
-            pICMS = tagtext(oNode=el_imp_ICMS, cTag="pICMS")
-
-            vIPI = tagtext(oNode=el_imp_IPI, cTag="vIPI")
-            pIPI = tagtext(oNode=el_imp_IPI, cTag="pIPI")
-
-            self.stringcenter(nMr - 112.5, nLin, tagtext(oNode=el_prod, cTag="NCM"))
-            self.stringcenter(nMr - 105, nLin, cCST)
-            self.stringcenter(nMr - 99, nLin, tagtext(oNode=el_prod, cTag="CFOP"))
-            self.stringcenter(nMr - 93, nLin, tagtext(oNode=el_prod, cTag="uCom"))
-            self.stringRight(
-                nMr - 78.5, nLin, format_number(tagtext(oNode=el_prod, cTag="qCom"))
-            )
-            self.stringRight(
-                nMr - 64.5, nLin, format_number(tagtext(oNode=el_prod, cTag="vUnCom"))
-            )
-            self.stringRight(
-                nMr - 50.5, nLin, format_number(tagtext(oNode=el_prod, cTag="vProd"))
-            )
-            self.stringRight(nMr - 38.5, nLin, format_number(vBC or "0.00"))
-            self.stringRight(nMr - 26.5, nLin, format_number(vICMS or "0.00"))
-            self.stringRight(nMr - 7.5, nLin, format_number(pICMS or "0.00"))
-
-            self.stringRight(nMr - 14.5, nLin, format_number(vIPI or "0.00"))
-            self.stringRight(nMr - 0.5, nLin, format_number(pIPI or "0.00"))
-
-            # Código Item
-            line_cod = nLin
-            for des in list_cod_prod[id]:
-                self.string(self.nLeft + 0.2, line_cod, des)
-                line_cod += nStep
-
-            # Descrição Item
-            line_desc = nLin
-            for des in list_desc[id]:
-                self.string(self.nLeft + 15.5, line_desc, des)
-                line_desc += nStep
-
-            nLin = max(line_cod, line_desc)
-            self.canvas.setStrokeColor(gray)
-            self.hline(self.nLeft, nLin - 2, self.width - self.nLeft)
-            self.canvas.setStrokeColor(black)
-
-        self.nlin += nH + 3
-        return id
-
-    def calculo_issqn(self, oXML=None):
-        elem_emit = oXML.find(".//{http://www.portalfiscal.inf.br/nfe}emit")
-        el_total = oXML.find(".//{http://www.portalfiscal.inf.br/nfe}total")
-        issqn_total = el_total.find(".//{http://www.portalfiscal.inf.br/nfe}ISSQNtot")
+    def calculo_issqn(self, oNFe=None):
+        elem_emit = oNFe.emit
+        issqn_total = oNFe.issqn
         if not issqn_total:
             return 0
 
@@ -994,30 +1239,28 @@ obsCont[@xCampo='NomeVendedor']"
         self.string(nMr - 46.5, self.nlin + 3.8, "VALOR DO ISSQN")
         # Conteúdo campos
         self.canvas.setFont("NimbusSanL-Regu", 8)
-        self.string(
-            self.nLeft + 1, self.nlin + 6.7, tagtext(oNode=elem_emit, cTag="IM")
-        )
+        self.string(self.nLeft + 1, self.nlin + 6.7, elem_emit["IM"])
         self.stringRight(
             self.nLeft + 94,
             self.nlin + 6.7,
-            format_number(tagtext(oNode=issqn_total, cTag="vServ")),
+            format_number(issqn_total["vServ"]),
         )
         self.stringRight(
             self.nLeft + 141.5,
             self.nlin + 6.7,
-            format_number(tagtext(oNode=issqn_total, cTag="vBC")),
+            format_number(issqn_total["vBC"]),
         )
         self.stringRight(
             self.nLeft + 189,
             self.nlin + 6.7,
-            format_number(tagtext(oNode=issqn_total, cTag="vISS")),
+            format_number(issqn_total["vISS"]),
         )
 
         self.nlin += 8  # Nr linhas ocupadas pelo bloco
         return 8
 
-    def adicionais(self, oXML=None, tamanho_diminuir=0):
-        el_infAdic = oXML.find(".//{http://www.portalfiscal.inf.br/nfe}infAdic")
+    def adicionais(self, oNFe=None, tamanho_diminuir=0):
+        el_infAdic = oNFe.infAdic
 
         self.nlin += 2
         self.canvas.setFont("NimbusSanL-Bold", 6)
@@ -1038,8 +1281,8 @@ obsCont[@xCampo='NomeVendedor']"
         styleN.fontSize = 6
         styleN.fontName = "NimbusSanL-Regu"
         styleN.leading = 7
-        fisco = tagtext(oNode=el_infAdic, cTag="infAdFisco")
-        observacoes = tagtext(oNode=el_infAdic, cTag="infCpl")
+        fisco = el_infAdic["infAdFisco"]
+        observacoes = el_infAdic["infCpl"]
         if fisco:
             observacoes = fisco + " " + observacoes
         P = Paragraph(observacoes, styles["Normal"])
@@ -1048,11 +1291,11 @@ obsCont[@xCampo='NomeVendedor']"
         P.drawOn(self.canvas, (self.nLeft + 1) * mm, altura - h)
         self.nlin += 36
 
-    def recibo_entrega(self, oXML=None, timezone=None):
-        el_ide = oXML.find(".//{http://www.portalfiscal.inf.br/nfe}ide")
-        el_dest = oXML.find(".//{http://www.portalfiscal.inf.br/nfe}dest")
-        el_total = oXML.find(".//{http://www.portalfiscal.inf.br/nfe}total")
-        el_emit = oXML.find(".//{http://www.portalfiscal.inf.br/nfe}emit")
+    def recibo_entrega(self, oNFe=None, timezone=None):
+        el_ide = oNFe.ide
+        el_dest = oNFe.dest
+        el_total = oNFe.total
+        el_emit = oNFe.emit
 
         # self.nlin = self.height-self.nBottom-18  # 17 altura recibo
         nW = 40
@@ -1072,39 +1315,29 @@ obsCont[@xCampo='NomeVendedor']"
         self.stringcenter(self.width - self.nRight - (nW / 2), self.nlin + 2, "NF-e")
         # Conteúdo campos
         self.canvas.setFont("NimbusSanL-Bold", 8)
-        cNF = tagtext(oNode=el_ide, cTag="nNF")
+        cNF = el_ide["nNF"]
         cNF = "{:011,}".format(int(cNF)).replace(",", ".")
         self.string(self.width - self.nRight - nW + 2, self.nlin + 8, "Nº %s" % (cNF))
         self.string(
             self.width - self.nRight - nW + 2,
             self.nlin + 14,
-            "SÉRIE %s" % (tagtext(oNode=el_ide, cTag="serie")),
+            "SÉRIE %s" % (el_ide["serie"]),
         )
 
-        cDt, cHr = getdateByTimezone(tagtext(oNode=el_ide, cTag="dhEmi"), timezone)
-        cTotal = format_number(tagtext(oNode=el_total, cTag="vNF"))
+        cDt, cHr = getdateByTimezone(el_ide["dhEmi"], timezone)
+        cTotal = format_number(el_total["vNF"])
 
-        cEnd = tagtext(oNode=el_dest, cTag="xNome") + " - "
-        cEnd += (
-            tagtext(oNode=el_dest, cTag="xLgr")
-            + ", "
-            + tagtext(oNode=el_dest, cTag="nro")
-            + ", "
-        )
-        cEnd += tagtext(oNode=el_dest, cTag="xCpl") + " "
-        cEnd += (
-            tagtext(oNode=el_dest, cTag="xBairro")
-            + ", "
-            + tagtext(oNode=el_dest, cTag="xMun")
-            + " - "
-        )
-        cEnd += tagtext(oNode=el_dest, cTag="UF")
+        cEnd = el_dest["xNome"] + " - "
+        cEnd += el_dest["xLgr"] + ", " + el_dest["nro"] + ", "
+        cEnd += el_dest["xCpl"] + " "
+        cEnd += el_dest["xBairro"] + ", " + el_dest["xMun"] + " - "
+        cEnd += el_dest["UF"]
 
         cString = """
         RECEBEMOS DE %s OS PRODUTOS/SERVIÇOS CONSTANTES DA NOTA FISCAL INDICADA
         ABAIXO. EMISSÃO: %s VALOR TOTAL: %s
         DESTINATARIO: %s""" % (
-            tagtext(oNode=el_emit, cTag="xNome"),
+            el_emit["xNome"],
             cDt,
             cTotal,
             cEnd,
@@ -1159,11 +1392,13 @@ obsCont[@xCampo='NomeVendedor']"
         self.canvas.drawCentredString(x * mm, y * mm, value)
 
     def writeto_pdf(self, fileObj):
-        pdf_out = self.oPDF_IO.getvalue()
+        if fileObj is self.oPDF_IO:
+            return
+        with self.oPDF_IO.getbuffer() as pdf_out:
+            fileObj.write(pdf_out)
         self.oPDF_IO.close()
-        fileObj.write(pdf_out)
 
-    def _generate_cce(self, cce_xml=None, oXML=None, timezone=None):
+    def _generate_cce(self, cce_xml=None, oNFe=None, timezone=None):
         self.canvas.setLineWidth(0.2)
 
         # labels
@@ -1187,12 +1422,9 @@ obsCont[@xCampo='NomeVendedor']"
         self.hline(9, 50, 200)
 
         # values
-        infNFe = oXML.find(".//{http://www.portalfiscal.inf.br/nfe}infNFe")
-        res_partner = infNFe.find(".//{http://www.portalfiscal.inf.br/nfe}xNome")
-
         elem_infNFe = cce_xml.find(".//{http://www.portalfiscal.inf.br/nfe}infEvento")
 
-        res_partner = tagtext(oNode=infNFe, cTag="xNome")
+        res_partner = oNFe.emit["xNome"]
         self.string(82, 18, res_partner)
         cnpj = format_cnpj_cpf(tagtext(oNode=elem_infNFe, cTag="CNPJ"))
         self.string(82, 24, cnpj)
@@ -0,0 +1,126 @@
+# Copyright 2023 Engenere.one
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+# Geração do DANFE em paralelo para lotes grandes de notas
+
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+import pytz
+from PyPDF2 import PdfFileMerger
+
+from .danfe import Danfe, DanfeProfiler
+from .nfe_data import parse_nfe, parse_xml
+
+
+def render_chunk(
+    list_xml,
+    list_logo=None,
+    tz_name=None,
+    profile=False,
+    list_cce=None,
+    stream_size=0,
+):
+    """Gera o PDF de um grupo de notas.
+
+    Recebe apenas bytes e o nome do timezone para que os argumentos
+    possam ser enviados a outro processo. XMLs maiores que stream_size
+    bytes são lidos com iterparse.
+
+    :return: (bytes do PDF, total medido pelo DanfeProfiler ou None)
+    """
+    tmpDanfe = BytesIO()
+    profiler = DanfeProfiler(log_batch=False) if profile else None
+    Danfe(
+        list_xml=[parse_nfe(xml, stream_size) for xml in list_xml],
+        list_logo=[logo and BytesIO(logo) or False for logo in list_logo]
+        if list_logo is not None
+        else None,
+        timezone=tz_name and pytz.timezone(tz_name) or None,
+        fileObj=tmpDanfe,
+        profiler=profiler,
+        list_cce=[[parse_xml(xml) for xml in cces] for cces in list_cce]
+        if list_cce is not None
+        else None,
+    )
+    return tmpDanfe.getvalue(), profiler and profiler.get_stats()
+
+
+def merge_pdfs(list_pdf, fileObj):
+    """Une os PDFs na ordem recebida, mantendo os marcadores de cada um."""
+    merger = PdfFileMerger(strict=False)
+    for pdf in list_pdf:
+        merger.append(BytesIO(pdf), import_bookmarks=True)
+    merger.write(fileObj)
+    merger.close()
+
+
+def render_parallel(
+    list_xml,
+    list_logo=None,
+    timezone=None,
+    max_workers=None,
+    fileObj=None,
+    profile=False,
+    list_cce=None,
+    stream_size=0,
+):
+    """Divide as notas entre um pool de processos e devolve um único PDF.
+
+    :param list_xml: lista com os bytes do XML de cada nota
+    :param list_logo: lista paralela com os bytes do logo de cada nota
+    :param timezone: timezone pytz do usuário
+    :param max_workers: nr. de processos, por padrão o nr. de CPUs
+    :param fileObj: arquivo onde o PDF final é gravado
+    :param profile: registra no log o tempo de cada seção, uma linha por
+        nota e uma com o total de todos os grupos
+    :param list_cce: lista paralela com os bytes das cartas de correção de
+        cada nota
+    :param stream_size: XMLs maiores que isso, em bytes, são lidos com
+        iterparse (0 desativa)
+    :return: bytes do PDF final, ou None se fileObj for informado
+    """
+    profiler = DanfeProfiler() if profile else None
+    max_workers = max_workers or os.cpu_count() or 1
+    # Grupos menores que len / workers equilibram melhor notas de
+    # tamanhos diferentes entre os processos
+    chunk_size = max(1, math.ceil(len(list_xml) / (max_workers * 2)))
+
+    jobs = []
+    for start in range(0, len(list_xml), chunk_size):
+        jobs.append(
+            (
+                list_xml[start : start + chunk_size],
+                list_logo[start : start + chunk_size]
+                if list_logo is not None
+                else None,
+                timezone and timezone.zone,
+                profile,
+                list_cce[start : start + chunk_size] if list_cce is not None else None,
+                stream_size,
+            )
+        )
+
+    # fork: os processos filhos herdam os módulos já importados pelo worker
+    # e não precisam reconstruir o ambiente do odoo
+    with ProcessPoolExecutor(
+        max_workers=min(max_workers, len(jobs)),
+        mp_context=multiprocessing.get_context("fork"),
+    ) as executor:
+        futures = [executor.submit(render_chunk, *job) for job in jobs]
+        list_pdf = []
+        for future in futures:
+            pdf, stats = future.result()
+            list_pdf.append(pdf)
+            if profiler:
+                profiler.merge(stats)
+
+    tmpDanfe = fileObj if fileObj is not None else BytesIO()
+    merge_pdfs(list_pdf, tmpDanfe)
+    if profiler:
+        profiler.end_batch()
+    if fileObj is not None:
+        return None
+    return tmpDanfe.getvalue()
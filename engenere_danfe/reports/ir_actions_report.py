@@ -1,20 +1,27 @@
 # Copyright 2023 Engenere.one
 # License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
 import base64
+import hashlib
 import logging
 from io import BytesIO
 
 import pytz
-from erpbrasil.edoc.pdf import base
 from lxml import etree
 
 from odoo import _, models
 from odoo.exceptions import UserError
+from odoo.tools import config
+from odoo.tools.pdf import merge_pdf
 
-from .danfe import Danfe
+# O gerador do DANFE é importado só na primeira impressão, workers que
+# nunca imprimem não carregam esses módulos
 
 _logger = logging.getLogger(__name__)
 
+# Logos decodificados e reduzidos por (banco, empresa, campo), junto com o
+# checksum da imagem original
+_logo_cache = {}
+
 
 class IrActionsReport(models.Model):
     _inherit = "ir.actions.report"
@@ -33,67 +40,283 @@ class IrActionsReport(models.Model):
         ]:
             return super(IrActionsReport, self)._render_qweb_pdf(res_ids, data=data)
 
-        nfe = self.env["account.move"].search([("id", "in", res_ids)])
+        # browse mantém a ordem em que as notas foram selecionadas
+        nfes = self.env["account.move"].browse(res_ids).exists()
+        self._check_danfe_moves(nfes)
+
+        if self.report_name == "engenere_danfe.main_template_danfe_oca":
+            return self.print_danfe_oca(nfes)
 
-        if nfe.document_type != "55":
+        return self._render_danfe_batch(nfes), "pdf"
+
+    def _check_danfe_moves(self, nfes):
+        if not nfes or nfes.filtered(lambda n: n.document_type != "55"):
             raise UserError(_("You can only print a danfe of a NFe(55)."))
-        if nfe.state != "posted":
+        if nfes.filtered(lambda n: n.state != "posted"):
             raise UserError(_("You can only print a posted NFe."))
 
-        if self.report_name == "engenere_danfe.main_template_danfe_oca":
-            return self.print_danfe_oca(nfe)
-
-        nfe_xml = False
-        if nfe.authorization_file_id:
-            nfe_xml = base64.b64decode(nfe.authorization_file_id.datas)
-        elif nfe.send_file_id:
-            nfe_xml = base64.b64decode(nfe.send_file_id.datas)
-
-        if not nfe_xml:
-            raise UserError(_("No xml file was found."))
-
-        logo = False
-        if nfe.issuer == "company" and nfe.company_id.logo:
-            logo = base64.b64decode(nfe.company_id.logo)
-        elif nfe.issuer != "company" and nfe.company_id.logo_web:
-            logo = base64.b64decode(nfe.company_id.logo_web)
-
-        if logo:
-            tmpLogo = BytesIO()
-            tmpLogo.write(logo)
-            tmpLogo.seek(0)
-        else:
-            tmpLogo = False
+    def _get_danfe_xml_files(self, nfes):
+        """Lê de uma só vez os XMLs de todas as notas.
 
-        timezone = pytz.timezone(self.env.context.get("tz") or "UTC")
+        :return: dict {account.move id: bytes do xml}
+        """
+        file_by_move = {}
+        for nfe in nfes:
+            xml_file = nfe.authorization_file_id or nfe.send_file_id
+            if not xml_file:
+                raise UserError(_("No xml file was found."))
+            file_by_move[nfe.id] = xml_file.id
 
-        xml_element = etree.fromstring(nfe_xml)
-        oDanfe = Danfe(
-            list_xml=[xml_element],
-            logo=tmpLogo,
-            timezone=timezone,
+        # raw lê os bytes do filestore sem o base64 do datas
+        raw_by_file = {
+            values["id"]: values["raw"]
+            for values in self.env["ir.attachment"]
+            .browse(set(file_by_move.values()))
+            .read(["raw"])
+        }
+        return {
+            move_id: raw_by_file[file_id] for move_id, file_id in file_by_move.items()
+        }
+
+    def _get_danfe_cce_files(self, nfes):
+        """Lê em uma só consulta as cartas de correção autorizadas de todas
+        as notas, na ordem da sequência do evento.
+
+        :return: dict {account.move id: lista com os bytes de cada xml}
+        """
+        moves_by_document = {}
+        for nfe in nfes:
+            moves_by_document.setdefault(nfe.fiscal_document_id.id, []).append(nfe.id)
+        events = self.env["l10n_br_fiscal.event"].search(
+            [
+                ("document_id", "in", list(moves_by_document)),
+                ("type", "=", "14"),
+                ("state", "=", "done"),
+                ("file_request_id", "!=", False),
+            ]
         )
+        events = events.sorted(lambda e: (int(e.sequence or 0), e.id))
+        raw_by_file = {
+            values["id"]: values["raw"]
+            for values in events.mapped("file_request_id").read(["raw"])
+        }
 
-        tmpDanfe = BytesIO()
-        oDanfe.writeto_pdf(tmpDanfe)
-        danfe_file = tmpDanfe.getvalue()
-        tmpDanfe.close()
+        cce_by_move = {nfe.id: [] for nfe in nfes}
+        for event in events:
+            for move_id in moves_by_document[event.document_id.id]:
+                cce_by_move[move_id].append(raw_by_file[event.file_request_id.id])
+        return cce_by_move
 
-        return danfe_file, "pdf"
+    def _get_danfe_xml_trees(self, nfes, xml_by_move=None, stream_size=0):
+        """Interpreta uma única vez o XML de cada nota. Se a nota ainda não
+        tem o XML de autorização, o nfeProc é montado a partir do XML de
+        envio (nfe_data.parse_nfe).
 
-    def print_danfe_oca(self, nfe):
+        :param stream_size: XMLs maiores que isso, em bytes, não viram
+            árvore, o Danfe lê os itens com iterparse (0 desativa)
+        :return: dict {account.move id: raiz do XML ou NFeStream}
+        """
+        from .nfe_data import parse_nfe
 
-        if nfe.authorization_file_id:
-            arquivo = nfe.authorization_file_id
-            xml_string = base64.b64decode(arquivo.datas).decode()
+        if xml_by_move is None:
+            xml_by_move = self._get_danfe_xml_files(nfes)
+        return {nfe.id: parse_nfe(xml_by_move[nfe.id], stream_size) for nfe in nfes}
+
+    def _get_danfe_logos(self, nfes):
+        """Logo de cada nota, decodificado uma única vez por empresa.
+
+        :return: dict {account.move id: bytes do logo ou False}
+        """
+        logo_cache = {}
+        logo_by_move = {}
+        for nfe in nfes:
+            field = "logo" if nfe.issuer == "company" else "logo_web"
+            key = (nfe.company_id.id, field)
+            if key not in logo_cache:
+                logo_cache[key] = self._get_danfe_company_logo(nfe.company_id, field)
+            logo_by_move[nfe.id] = logo_cache[key]
+        return logo_by_move
+
+    def _get_danfe_logo_attachment(self, company):
+        """Anexo da imagem do parceiro da empresa. O logo (related) e o
+        logo_web (calculado e guardado na tabela) vêm dessa imagem, o
+        checksum do anexo identifica os dois sem decodificar o base64."""
+        return (
+            self.env["ir.attachment"]
+            .sudo()
+            .search(
+                [
+                    ("res_model", "=", "res.partner"),
+                    ("res_field", "=", "image_1920"),
+                    ("res_id", "=", company.partner_id.id),
+                ],
+                limit=1,
+            )
+        )
+
+    def _get_danfe_company_logo(self, company, field):
+        """Logo da empresa já decodificado e reduzido para a impressão,
+        guardado no processo enquanto o checksum da imagem não mudar.
+
+        :return: bytes do logo ou False
+        """
+        attachment = self._get_danfe_logo_attachment(company)
+        if attachment:
+            checksum = attachment.checksum
+        else:
+            logo = company[field]
+            checksum = logo and hashlib.sha1(logo).hexdigest()
+        if not checksum:
+            return False
+        key = (self.env.cr.dbname, company.id, field)
+        cached = _logo_cache.get(key)
+        if cached and cached[0] == checksum:
+            return cached[1]
+
+        if attachment and field == "logo":
+            logo = attachment.raw
         else:
-            arquivo = nfe.send_file_id
-            xml_string = base64.b64decode(arquivo.datas).decode()
-            xml_string = nfe.temp_xml_autorizacao(xml_string)
+            logo = base64.b64decode(company[field] or b"")
+        if not logo:
+            return False
+        from .danfe import scale_logo
+
+        logo = scale_logo(logo)
+        _logo_cache[key] = (checksum, logo)
+        return logo
 
-        pdf = base.ImprimirXml.imprimir(
-            string_xml=xml_string,
-            # output_dir=self.authorization_event_id.file_path
+    def _get_danfe_pool_settings(self):
+        """Lotes acima de engenere_danfe.pool_threshold notas são divididos
+        entre engenere_danfe.pool_workers processos (0, o padrão, desativa).
+
+        O pool só é usado com o servidor em modo multi-processo (workers):
+        no servidor com threads o fork herdaria as conexões com o banco e
+        os locks das outras threads.
+        """
+        if not config["workers"]:
+            return 0, None
+        ICP = self.env["ir.config_parameter"].sudo()
+        threshold = int(ICP.get_param("engenere_danfe.pool_threshold", 0))
+        workers = int(ICP.get_param("engenere_danfe.pool_workers", 0))
+        return threshold, workers or None
+
+    def _get_danfe_stream_size(self):
+        """XMLs acima de engenere_danfe.stream_threshold_kb são lidos item a
+        item com iterparse (0, o padrão, desativa). O XML é lido duas vezes,
+        só compensa quando a árvore inteira não cabe na memória."""
+        ICP = self.env["ir.config_parameter"].sudo()
+        return int(ICP.get_param("engenere_danfe.stream_threshold_kb", 0)) * 1024
+
+    def _get_danfe_profile_enabled(self):
+        """Tempo de cada seção do DANFE no log, ativado pela chave de
+        contexto danfe_profile ou pelo parâmetro engenere_danfe.profile."""
+        return bool(
+            self.env.context.get("danfe_profile")
+            or self.env["ir.config_parameter"]
+            .sudo()
+            .get_param("engenere_danfe.profile")
+        )
+
+    def _get_danfe_timezone(self):
+        return pytz.timezone(self.env.context.get("tz") or "UTC")
+
+    def _get_danfe_cache_key(self, nfes, xml_by_move, logo_by_move, cce_by_move=None):
+        """Hash de tudo que influencia o PDF gerado: XMLs, logos, cartas de
+        correção, timezone e versão do gerador. PDFs com a mesma chave são
+        idênticos."""
+        from .danfe import RENDERER_VERSION
+
+        digest = hashlib.sha256()
+        parts = [RENDERER_VERSION.encode(), self._get_danfe_timezone().zone.encode()]
+        for nfe in nfes:
+            parts.append(xml_by_move[nfe.id])
+            parts.append(logo_by_move[nfe.id] or b"")
+            # Nr. de cartas antes dos XMLs, separa as notas sem ambiguidade
+            list_cce = (cce_by_move or {}).get(nfe.id, [])
+            parts.append(str(len(list_cce)).encode())
+            parts.extend(list_cce)
+        for part in parts:
+            # hash de cada parte, evita colisões por concatenação
+            digest.update(hashlib.sha256(part).digest())
+        return digest.hexdigest()
+
+    def _render_danfe_batch(
+        self, nfes, xml_by_move=None, logo_by_move=None, fileObj=None, cce_by_move=None
+    ):
+        """Gera um único PDF com o DANFE de todas as notas, cada uma seguida
+        das suas cartas de correção, em uma só execução do Danfe ou, para
+        lotes grandes, em um pool de processos.
+
+        Com fileObj o PDF é gravado direto nele e nada é retornado, senão
+        retorna os bytes do PDF.
+        """
+        from .danfe import Danfe, DanfeProfiler
+        from .danfe_pool import render_parallel
+        from .nfe_data import parse_xml
+
+        if xml_by_move is None:
+            xml_by_move = self._get_danfe_xml_files(nfes)
+        if logo_by_move is None:
+            logo_by_move = self._get_danfe_logos(nfes)
+        if cce_by_move is None:
+            cce_by_move = self._get_danfe_cce_files(nfes)
+        timezone = self._get_danfe_timezone()
+        profile = self._get_danfe_profile_enabled()
+        stream_size = self._get_danfe_stream_size()
+
+        threshold, workers = self._get_danfe_pool_settings()
+        if threshold and len(nfes) > threshold:
+            return render_parallel(
+                [xml_by_move[nfe.id] for nfe in nfes],
+                list_logo=[logo_by_move[nfe.id] for nfe in nfes],
+                timezone=timezone,
+                max_workers=workers,
+                fileObj=fileObj,
+                profile=profile,
+                list_cce=[cce_by_move[nfe.id] for nfe in nfes],
+                stream_size=stream_size,
+            )
+
+        tree_by_move = self._get_danfe_xml_trees(
+            nfes, xml_by_move=xml_by_move, stream_size=stream_size
         )
+        list_xml = []
+        list_logo = []
+        list_cce = []
+        for nfe in nfes:
+            list_xml.append(tree_by_move[nfe.id])
+            logo = logo_by_move[nfe.id]
+            list_logo.append(logo and BytesIO(logo) or False)
+            list_cce.append([parse_xml(xml) for xml in cce_by_move[nfe.id]])
+
+        tmpDanfe = fileObj if fileObj is not None else BytesIO()
+        Danfe(
+            list_xml=list_xml,
+            list_logo=list_logo,
+            timezone=timezone,
+            fileObj=tmpDanfe,
+            profiler=DanfeProfiler() if profile else None,
+            list_cce=list_cce,
+        )
+        if fileObj is not None:
+            return None
+        return tmpDanfe.getvalue()
+
+    def print_danfe_oca(self, nfes):
+        """DANFE da OCA de cada nota. O XML de autorização vai direto para o
+        ImprimirXml, que o interpreta uma única vez; só o XML de envio é
+        lido aqui, para ser colocado em um nfeProc."""
+        from erpbrasil.edoc.pdf import base
+
+        from .nfe_data import build_nfe_proc, is_nfe_proc, parse_xml
+
+        xml_by_move = self._get_danfe_xml_files(nfes)
+        pdfs = []
+        for nfe in nfes:
+            xml = xml_by_move[nfe.id]
+            if not is_nfe_proc(xml):
+                xml = etree.tostring(build_nfe_proc(parse_xml(xml)))
+            pdfs.append(base.ImprimirXml.imprimir(string_xml=xml))
 
+        pdf = pdfs[0] if len(pdfs) == 1 else merge_pdf(pdfs)
         return pdf, "pdf"
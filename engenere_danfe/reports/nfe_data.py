@@ -0,0 +1,307 @@
+# Copyright 2023 Engenere.one
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+# Leitura do XML da NF-e em uma única passada para uso na geração do DANFE
+
+from io import BytesIO
+
+from lxml import etree
+
+NFE_NS = "http://www.portalfiscal.inf.br/nfe"
+
+
+# Opções do parser para XMLs recebidos de fora: sem entidades externas e
+# sem acesso à rede
+PARSER_OPTIONS = {"resolve_entities": False, "no_network": True}
+
+
+def localname(cTag):
+    return cTag.rpartition("}")[2]
+
+
+def parse_xml(xml):
+    """Árvore de um XML (NF-e, evento) lido com PARSER_OPTIONS."""
+    return etree.fromstring(xml, parser=etree.XMLParser(**PARSER_OPTIONS))
+
+
+def is_nfe_proc(xml):
+    """Se a raiz do XML é um nfeProc, lendo só até a tag da raiz."""
+    context = etree.iterparse(BytesIO(xml), events=("start",), **PARSER_OPTIONS)
+    for _event, el in context:
+        return isinstance(el.tag, str) and localname(el.tag) == "nfeProc"
+    return False
+
+
+def build_nfe_proc(root):
+    """XML de envio (NFe) dentro de um nfeProc com um protNFe vazio, para a
+    impressão de notas ainda não autorizadas. Outros XMLs voltam como estão.
+    """
+    if not isinstance(root.tag, str) or localname(root.tag) != "NFe":
+        return root
+    nfe_proc = etree.Element(
+        "{%s}nfeProc" % NFE_NS, attrib={"versao": "4.00"}, nsmap={None: NFE_NS}
+    )
+    nfe_proc.append(root)
+
+    prot_nfe = etree.SubElement(nfe_proc, "{%s}protNFe" % NFE_NS, versao="4.00")
+    inf_prot = etree.SubElement(prot_nfe, "{%s}infProt" % NFE_NS)
+    for tag, text in (
+        ("tpAmb", "2"),
+        ("verAplic", ""),
+        ("dhRecbto", None),
+        ("nProt", ""),
+        ("digVal", ""),
+        ("cStat", ""),
+        ("xMotivo", ""),
+    ):
+        etree.SubElement(inf_prot, "{%s}%s" % (NFE_NS, tag)).text = text
+    return nfe_proc
+
+
+class NFeGroup(object):
+    """Textos de um grupo do XML indexados pelo nome da tag.
+
+    Guarda apenas a primeira ocorrência de cada tag, o mesmo resultado de
+    um tagtext(oNode=grupo, cTag=tag). Tags ausentes retornam "".
+    """
+
+    __slots__ = ("values",)
+
+    def __init__(self, oNode=None):
+        values = {}
+        if oNode is not None:
+            for el in oNode.iterdescendants():
+                cTag = el.tag
+                if not isinstance(cTag, str):  # comentários
+                    continue
+                cTag = localname(cTag)
+                if cTag not in values:
+                    values[cTag] = el.text or ""
+        self.values = values
+
+    def __getitem__(self, cTag):
+        return self.values.get(cTag, "")
+
+    def __bool__(self):
+        return bool(self.values)
+
+
+class NFeItem(object):
+    """Dados de um item (det) usados no quadro de produtos."""
+
+    __slots__ = (
+        "cProd",
+        "xProd",
+        "infAdProd",
+        "NCM",
+        "CFOP",
+        "uCom",
+        "qCom",
+        "vUnCom",
+        "vProd",
+        "orig",
+        "CST",
+        "CSOSN",
+        "vBC",
+        "vICMS",
+        "pICMS",
+        "vIPI",
+        "pIPI",
+    )
+
+    def __init__(self, oNode):
+        prod = icms = ipi = None
+        infAdProd = None
+        for child in oNode:
+            cTag = localname(child.tag) if isinstance(child.tag, str) else None
+            if cTag == "prod":
+                prod = NFeGroup(child)
+            elif cTag == "imposto":
+                for tax in child:
+                    cTax = localname(tax.tag) if isinstance(tax.tag, str) else None
+                    if cTax == "ICMS" and icms is None:
+                        icms = NFeGroup(tax)
+                    elif cTax == "IPI" and ipi is None:
+                        ipi = NFeGroup(tax)
+            elif cTag == "infAdProd" and infAdProd is None:
+                infAdProd = child.text
+        prod = prod or NFeGroup()
+        icms = icms or NFeGroup()
+        ipi = ipi or NFeGroup()
+
+        self.cProd = prod["cProd"]
+        self.xProd = prod["xProd"]
+        self.infAdProd = infAdProd
+        self.NCM = prod["NCM"]
+        self.CFOP = prod["CFOP"]
+        self.uCom = prod["uCom"]
+        self.qCom = prod["qCom"]
+        self.vUnCom = prod["vUnCom"]
+        self.vProd = prod["vProd"]
+        self.orig = icms["orig"]
+        self.CST = icms["CST"]
+        self.CSOSN = icms["CSOSN"]
+        self.vBC = icms["vBC"]
+        self.vICMS = icms["vICMS"]
+        self.pICMS = icms["pICMS"]
+        self.vIPI = ipi["vIPI"]
+        self.pIPI = ipi["pIPI"]
+
+
+class NFeData(object):
+    """Visão da NF-e montada percorrendo o XML uma única vez.
+
+    Os grupos do infNFe são lidos a partir dos seus filhos diretos, sem
+    buscas .//tag repetidas na árvore inteira para cada campo impresso.
+    """
+
+    __slots__ = (
+        "chave",
+        "ide",
+        "emit",
+        "dest",
+        "entrega",
+        "retirada",
+        "total",
+        "issqn",
+        "transp",
+        "veic_transp",
+        "cobr",
+        "infAdic",
+        "obs_cont",
+        "prot",
+        "evento",
+        "items",
+    )
+
+    # Grupos filhos do infNFe lidos como NFeGroup
+    GROUPS = (
+        "ide",
+        "emit",
+        "dest",
+        "entrega",
+        "retirada",
+        "total",
+        "transp",
+        "infAdic",
+    )
+
+    def __init__(self, oXML):
+        self.chave = ""
+        for cTag in self.GROUPS:
+            setattr(self, cTag, NFeGroup())
+        self.issqn = NFeGroup()
+        self.veic_transp = NFeGroup()
+        self.cobr = None
+        self.obs_cont = {}
+        self.prot = NFeGroup()
+        self.evento = NFeGroup()
+        self.items = []
+
+        elem_infNFe = None
+        elem_protNFe = None
+        elem_evento = None
+        # Localiza infNFe, protNFe e infEvento sem descer dentro do infNFe
+        stack = [oXML]
+        while stack:
+            el = stack.pop()
+            if not isinstance(el.tag, str):
+                continue
+            cTag = localname(el.tag)
+            if cTag == "infNFe" and elem_infNFe is None and el is not oXML:
+                elem_infNFe = el
+                continue
+            if cTag == "protNFe" and elem_protNFe is None and el is not oXML:
+                elem_protNFe = el
+                continue
+            if cTag == "infEvento" and elem_evento is None and el is not oXML:
+                elem_evento = el
+                continue
+            stack.extend(reversed(el))
+
+        if elem_protNFe is not None:
+            self.prot = NFeGroup(elem_protNFe)
+        if elem_evento is not None:
+            self.evento = NFeGroup(elem_evento)
+        if elem_infNFe is not None:
+            self.chave = (elem_infNFe.attrib.get("Id") or "")[3:]
+            self._read_infNFe(elem_infNFe)
+
+    def _read_infNFe(self, elem_infNFe):
+        seen = set()
+        for child in elem_infNFe:
+            if not isinstance(child.tag, str):
+                continue
+            cTag = localname(child.tag)
+            if cTag == "det":
+                self.items.append(NFeItem(child))
+                continue
+            if cTag in seen:
+                continue
+            seen.add(cTag)
+            if cTag == "cobr":
+                self.cobr = [NFeGroup(dup) for dup in child]
+            elif cTag in self.GROUPS:
+                setattr(self, cTag, NFeGroup(child))
+                if cTag == "total":
+                    self._read_total(child)
+                elif cTag == "transp":
+                    self._read_transp(child)
+                elif cTag == "infAdic":
+                    self._read_infAdic(child)
+
+    def _read_total(self, elem_total):
+        for child in elem_total:
+            if isinstance(child.tag, str) and localname(child.tag) == "ISSQNtot":
+                self.issqn = NFeGroup(child)
+                break
+
+    def _read_transp(self, elem_transp):
+        for child in elem_transp:
+            if isinstance(child.tag, str) and localname(child.tag) == "veicTransp":
+                self.veic_transp = NFeGroup(child)
+                break
+
+    def _read_infAdic(self, elem_infAdic):
+        for child in elem_infAdic:
+            if isinstance(child.tag, str) and localname(child.tag) == "obsCont":
+                xCampo = child.get("xCampo")
+                if xCampo not in self.obs_cont:
+                    self.obs_cont[xCampo] = NFeGroup(child)["xTexto"]
+
+
+class NFeStream(object):
+    """NF-e lida com iterparse, para notas com dezenas de milhares de itens.
+
+    Cada det é removido da árvore assim que o item é lido, a árvore não
+    cresce com o nr. de itens (as páginas do PDF continuam na memória do
+    reportlab até o save). O XML é percorrido a cada iter_items();
+    ao final da leitura, data traz a NFeData da nota sem os itens, lida do
+    nfeProc como em parse_nfe.
+
+    :param source: bytes do XML ou caminho do arquivo
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.data = None
+
+    def iter_items(self):
+        source = self.source
+        if isinstance(source, bytes):
+            source = BytesIO(source)
+        context = etree.iterparse(
+            source, events=("end",), tag="{%s}det" % NFE_NS, **PARSER_OPTIONS
+        )
+        for _event, el in context:
+            yield NFeItem(el)
+            el.getparent().remove(el)
+        self.data = NFeData(build_nfe_proc(context.root))
+
+
+def parse_nfe(xml, stream_size=0):
+    """Árvore do XML da nota ou, se ele passa de stream_size bytes, uma
+    NFeStream (0 sempre monta a árvore). O XML de envio é colocado em um
+    nfeProc (build_nfe_proc) nos dois casos."""
+    if stream_size and len(xml) > stream_size:
+        return NFeStream(xml)
+    return build_nfe_proc(parse_xml(xml))
@@ -0,0 +1,4 @@
+from . import test_nfe_data
+from . import test_danfe_cache
+from . import test_danfe_controller
+from . import test_danfe_gc
@@ -0,0 +1,55 @@
+# Copyright 2023 Engenere.one
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+from odoo.tools import file_open
+
+# Chave válida do tests/data/nfe.xml
+NFE_KEY = "35230511222333000181550010000012341000123453"
+
+
+def read_data(name):
+    with file_open("engenere_danfe/tests/data/%s" % name, "rb") as f:
+        return f.read()
+
+
+def create_authorized_nfe(env, company, xml=None):
+    """Fatura com uma NF-e com chave e XML de autorização, sem itens.
+
+    :return: account.move
+    """
+    journal = env["account.journal"].create(
+        {
+            "company_id": company.id,
+            "name": "DANFE Journal - (test)",
+            "code": "DANFE",
+            "type": "sale",
+        }
+    )
+    move = (
+        env["account.move"]
+        .with_context(check_move_validity=False)
+        .create(
+            {
+                "company_id": company.id,
+                "document_type_id": env.ref("l10n_br_fiscal.document_55").id,
+                "document_serie_id": env.ref(
+                    "l10n_br_fiscal.empresa_lc_document_55_serie_1"
+                ).id,
+                "fiscal_operation_id": env.ref("l10n_br_fiscal.fo_venda").id,
+                "journal_id": journal.id,
+                "move_type": "out_invoice",
+                "currency_id": company.currency_id.id,
+            }
+        )
+    )
+    document = move.fiscal_document_id
+    document.document_key = NFE_KEY
+    document.authorization_file_id = env["ir.attachment"].create(
+        {
+            "name": NFE_KEY + "-nfe.xml",
+            "res_model": document._name,
+            "res_id": document.id,
+            "raw": xml or read_data("nfe.xml"),
+        }
+    )
+    return move
@@ -0,0 +1,105 @@
+# Copyright 2023 Engenere.one
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+import base64
+from io import BytesIO
+from unittest.mock import patch
+
+from PIL import Image
+
+from odoo.tests import SavepointCase
+
+from .common import create_authorized_nfe, read_data
+
+
+class TestDanfeCache(SavepointCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.company = cls.env.ref("l10n_br_base.empresa_lucro_presumido")
+        cls.env.user.company_ids |= cls.company
+        cls.env.user.company_id = cls.company
+        cls.report = cls.env.ref("engenere_danfe.report_engenere_danfe")
+        cls.move = create_authorized_nfe(cls.env, cls.company)
+        cls.document = cls.move.fiscal_document_id
+
+    def _make_danfe_pdf(self):
+        """:return: (anexo do DANFE, se o PDF foi gerado de novo)"""
+        IrActionsReport = type(self.report)
+        with patch.object(
+            IrActionsReport,
+            "_render_danfe_batch",
+            autospec=True,
+            side_effect=IrActionsReport._render_danfe_batch,
+        ) as render:
+            attachment = self.document._make_danfe_pdf(self.report)
+        return attachment, render.called
+
+    def _cache_key(self):
+        return self.document._get_danfe_data(self.report)[0]
+
+    def test_cache_hit(self):
+        attachment, rendered = self._make_danfe_pdf()
+        self.assertTrue(rendered)
+        self.assertEqual(self.document.file_report_id, attachment)
+        self.assertEqual(attachment.danfe_cache_key, self._cache_key())
+        self.assertTrue(attachment.raw.startswith(b"%PDF"))
+
+        cached, rendered = self._make_danfe_pdf()
+        self.assertFalse(rendered)
+        self.assertEqual(cached, attachment)
+
+    def test_xml_changed(self):
+        attachment, _rendered = self._make_danfe_pdf()
+        self.document.authorization_file_id.raw = read_data("nfe.xml").replace(
+            b"Informacoes complementares", b"Outras informacoes"
+        )
+        new_attachment, rendered = self._make_danfe_pdf()
+        self.assertTrue(rendered)
+        self.assertNotEqual(new_attachment, attachment)
+        self.assertNotEqual(new_attachment.danfe_cache_key, attachment.danfe_cache_key)
+        self.assertEqual(self.document.file_report_id, new_attachment)
+
+    def test_logo_changed(self):
+        attachment, _rendered = self._make_danfe_pdf()
+        logo = BytesIO()
+        Image.new("RGB", (20, 10), (200, 0, 0)).save(logo, "PNG")
+        self.company.partner_id.image_1920 = base64.b64encode(logo.getvalue())
+        new_attachment, rendered = self._make_danfe_pdf()
+        self.assertTrue(rendered)
+        self.assertNotEqual(new_attachment.danfe_cache_key, attachment.danfe_cache_key)
+
+    def test_cce_changed(self):
+        attachment, _rendered = self._make_danfe_pdf()
+        self.env["l10n_br_fiscal.event"].create(
+            {
+                "type": "14",
+                "state": "done",
+                "sequence": "1",
+                "document_id": self.document.id,
+                "document_type_id": self.document.document_type_id.id,
+                "document_serie_id": self.document.document_serie_id.id,
+                "document_number": "1234",
+                "company_id": self.company.id,
+                "file_request_id": self.env["ir.attachment"]
+                .create({"name": "cce.xml", "raw": read_data("cce.xml")})
+                .id,
+            }
+        )
+        new_attachment, rendered = self._make_danfe_pdf()
+        self.assertTrue(rendered)
+        self.assertNotEqual(new_attachment.danfe_cache_key, attachment.danfe_cache_key)
+
+    def test_renderer_version_changed(self):
+        cache_key = self._cache_key()
+        with patch("odoo.addons.engenere_danfe.reports.danfe.RENDERER_VERSION", "test"):
+            self.assertNotEqual(self._cache_key(), cache_key)
+        self.assertEqual(self._cache_key(), cache_key)
+
+    def test_timezone(self):
+        # As datas impressas dependem do timezone de quem gera o DANFE
+        keys = {
+            self.document._get_danfe_data(self.report.with_context(tz=tz))[0]
+            for tz in ("UTC", "America/Sao_Paulo")
+        }
+        self.assertEqual(len(keys), 2)
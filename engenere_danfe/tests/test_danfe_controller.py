@@ -0,0 +1,63 @@
+# Copyright 2023 Engenere.one
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+from odoo.tests import HttpCase, tagged
+
+from .common import NFE_KEY, create_authorized_nfe, read_data
+
+
+@tagged("post_install", "-at_install")
+class TestDanfeController(HttpCase):
+    def setUp(self):
+        super().setUp()
+        self.company = self.env.ref("l10n_br_base.empresa_lucro_presumido")
+        admin = self.env.ref("base.user_admin")
+        admin.company_ids |= self.company
+        admin.company_id = self.company
+        self.move = create_authorized_nfe(self.env, self.company)
+        self.document = self.move.fiscal_document_id
+        self.url = "/engenere_danfe/danfe/%s.pdf" % NFE_KEY
+        self.authenticate("admin", "admin")
+
+    def _download(self, etag=None):
+        return self.url_open(
+            self.url, headers={"If-None-Match": etag} if etag else None, timeout=60
+        )
+
+    def test_download(self):
+        response = self._download()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["Content-Type"], "application/pdf")
+        self.assertTrue(response.content.startswith(b"%PDF"))
+        etag = response.headers["ETag"]
+        self.assertTrue(etag)
+
+        response = self._download(etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers["ETag"], etag)
+
+        # O XML mudou, o ETag antigo não serve mais
+        self.document.authorization_file_id.raw = read_data("nfe.xml").replace(
+            b"Informacoes complementares", b"Outras informacoes"
+        )
+        response = self._download(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+    def test_download_keeps_file_report(self):
+        report = self.env.ref("engenere_danfe.report_engenere_danfe")
+        attachment = self.document._make_danfe_pdf(report.with_context(tz="UTC"))
+        self.env.ref("base.user_admin").tz = "America/Sao_Paulo"
+        response = self._download()
+        self.assertEqual(response.status_code, 200)
+        # A chave do download tem outro timezone, o DANFE da nota não muda
+        self.assertNotEqual(
+            response.headers["ETag"].strip('"'), attachment.danfe_cache_key
+        )
+        self.assertEqual(self.document.file_report_id, attachment)
+
+    def test_not_found(self):
+        response = self.url_open(
+            "/engenere_danfe/danfe/%s.pdf" % ("0" * 44), timeout=60
+        )
+        self.assertEqual(response.status_code, 404)
@@ -0,0 +1,98 @@
+# Copyright 2023 Engenere.one
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+from datetime import timedelta
+from unittest.mock import patch
+
+from odoo import fields
+from odoo.tests import SavepointCase
+
+from .common import create_authorized_nfe
+
+MB = 1024 * 1024
+
+
+class TestDanfeGc(SavepointCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.company = cls.env.ref("l10n_br_base.empresa_lucro_presumido")
+        cls.env.user.company_ids |= cls.company
+        cls.env.user.company_id = cls.company
+        cls.company.processador_edoc = "oca"
+        cls.report = cls.env.ref("engenere_danfe.report_engenere_danfe")
+        cls.move = create_authorized_nfe(cls.env, cls.company)
+        cls.document = cls.move.fiscal_document_id
+        cls.ICP = cls.env["ir.config_parameter"].sudo()
+        cls.ICP.set_param("engenere_danfe.cache_max_age_days", "30")
+        cls.ICP.set_param("engenere_danfe.cache_max_size_mb", "0")
+
+    def _cached_pdf(self, days, size=1024):
+        """DANFE em cache do documento criado há `days` dias."""
+        attachment = self.env["ir.attachment"].create(
+            {
+                "name": "danfe.pdf",
+                "res_model": self.document._name,
+                "res_id": self.document.id,
+                # conteúdos diferentes, cada anexo com seu arquivo
+                "raw": b"%PDF" + str(days).encode().ljust(size - 4, b"0"),
+                "mimetype": "application/pdf",
+                "danfe_cache_key": "key-%s-%s" % (days, size),
+            }
+        )
+        self.env.cr.execute(
+            "UPDATE ir_attachment SET create_date = %s WHERE id = %s",
+            (fields.Datetime.now() - timedelta(days=days), attachment.id),
+        )
+        attachment.invalidate_cache(["create_date"])
+        return attachment
+
+    def test_gc_by_age(self):
+        old = self._cached_pdf(40)
+        recent = self._cached_pdf(1)
+        current = self._cached_pdf(60)
+        self.document.file_report_id = current
+
+        self.env["ir.attachment"]._gc_danfe_cache()
+        self.assertFalse(old.exists())
+        self.assertTrue(recent.exists())
+        # O DANFE atual da nota nunca é removido, mesmo antigo
+        self.assertTrue(current.exists())
+        self.assertEqual(self.document.file_report_id, current)
+
+    def test_gc_by_size(self):
+        self.ICP.set_param("engenere_danfe.cache_max_size_mb", "1")
+        # O DANFE atual não entra na conta do tamanho
+        current = self._cached_pdf(5, 2 * MB)
+        self.document.file_report_id = current
+        newest = self._cached_pdf(1, MB // 2)
+        middle = self._cached_pdf(2, MB // 2)
+        oldest = self._cached_pdf(3, MB // 2)
+
+        self.env["ir.attachment"]._gc_danfe_cache()
+        self.assertTrue(current.exists())
+        self.assertTrue(newest.exists())
+        self.assertTrue(middle.exists())
+        self.assertFalse(oldest.exists())
+
+    def test_make_pdf_deferred(self):
+        self.document.with_context(engenere_danfe_defer=True).make_pdf()
+        self.assertTrue(self.document.danfe_pending)
+        self.assertFalse(self.document.file_report_id)
+
+    def test_cron_generate_pending(self):
+        self.document.danfe_pending = True
+        with patch.object(self.env.cr, "commit") as commit:
+            self.env["l10n_br_fiscal.document"]._cron_generate_pending_danfe()
+        self.assertTrue(commit.called)
+        self.assertFalse(self.document.danfe_pending)
+        self.assertTrue(self.document.file_report_id.raw.startswith(b"%PDF"))
+
+    def test_cron_keeps_failed_pending(self):
+        self.document.danfe_pending = True
+        self.document.authorization_file_id.raw = b"<nfeProc"
+        with patch.object(self.env.cr, "commit"):
+            self.env["l10n_br_fiscal.document"]._cron_generate_pending_danfe()
+        # A nota com erro continua na fila para a próxima execução
+        self.assertTrue(self.document.danfe_pending)
+        self.assertFalse(self.document.file_report_id)
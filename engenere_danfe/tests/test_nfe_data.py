@@ -0,0 +1,121 @@
+# Copyright 2023 Engenere.one
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+from lxml import etree
+
+from odoo.tests.common import TransactionCase
+
+from ..reports.danfe import (
+    PRODUCT_LINES_FIRST_PAGE,
+    PRODUCT_LINES_NEXT_PAGE,
+    plan_page_sizes,
+    tagtext,
+)
+from ..reports.nfe_data import NFE_NS, NFeData, NFeItem, NFeStream, parse_nfe
+from .common import NFE_KEY, read_data
+
+ITEM_TAGS = ("cProd", "xProd", "NCM", "CFOP", "uCom", "qCom", "vUnCom", "vProd")
+
+
+class TestNFeData(TransactionCase):
+    def setUp(self):
+        super().setUp()
+        self.xml = read_data("nfe.xml")
+        self.root = parse_nfe(self.xml)
+        self.infNFe = self.root.find(".//{%s}infNFe" % NFE_NS)
+
+    def _find(self, oNode, cTag):
+        return oNode.find(".//{%s}%s" % (NFE_NS, cTag))
+
+    def _item_values(self, item):
+        return {cTag: getattr(item, cTag) for cTag in NFeItem.__slots__}
+
+    def test_plan_page_sizes(self):
+        nFirst = PRODUCT_LINES_FIRST_PAGE - 1
+        nNext = PRODUCT_LINES_NEXT_PAGE - 1
+        # Sem itens ainda há a primeira página
+        self.assertEqual(plan_page_sizes([]), [0])
+        # Primeira página cheia, sem página de continuação
+        self.assertEqual(plan_page_sizes([1] * nFirst), [nFirst])
+        self.assertEqual(plan_page_sizes([1] * (nFirst + 1)), [nFirst, 1])
+        # Página de continuação cheia e com uma linha a mais
+        self.assertEqual(plan_page_sizes([1] * (nFirst + nNext)), [nFirst, nNext])
+        self.assertEqual(
+            plan_page_sizes([1] * (nFirst + nNext + 1)), [nFirst, nNext, 1]
+        )
+        # Um item de várias linhas que não cabe vai inteiro para a próxima
+        self.assertEqual(plan_page_sizes([3] * 9 + [2]), [9, 1])
+        # Item maior que uma página é impresso sozinho
+        self.assertEqual(plan_page_sizes([1, nNext + 10]), [1, 1])
+
+    def test_nfe_data_same_as_tagtext(self):
+        oNFe = NFeData(self.root)
+        self.assertEqual(oNFe.chave, NFE_KEY)
+        for group, tags in (
+            ("ide", ("nNF", "serie", "dhEmi", "natOp", "tpNF")),
+            ("emit", ("CNPJ", "xNome", "xLgr", "xMun", "IE", "CRT")),
+            ("dest", ("CNPJ", "xNome", "xLgr", "xMun", "IE")),
+            ("total", ("vBC", "vICMS", "vProd", "vIPI", "vNF")),
+            ("transp", ("modFrete", "xNome", "qVol", "pesoB")),
+            ("infAdic", ("infAdFisco", "infCpl")),
+        ):
+            elem = self._find(self.infNFe, group)
+            for cTag in tags:
+                self.assertEqual(
+                    getattr(oNFe, group)[cTag],
+                    tagtext(oNode=elem, cTag=cTag) or "",
+                    "%s/%s" % (group, cTag),
+                )
+        elem_protNFe = self._find(self.root, "protNFe")
+        for cTag in ("nProt", "dhRecbto", "cStat"):
+            self.assertEqual(oNFe.prot[cTag], tagtext(oNode=elem_protNFe, cTag=cTag))
+        self.assertEqual(
+            oNFe.veic_transp["placa"],
+            tagtext(oNode=self._find(self.infNFe, "veicTransp"), cTag="placa"),
+        )
+        # Grupos ausentes retornam "", como o tagtext
+        self.assertEqual(oNFe.issqn["vServ"], "")
+        self.assertEqual(
+            oNFe.obs_cont, {"CodVendedor": "V01", "NomeVendedor": "Vendedor"}
+        )
+        self.assertEqual(
+            [dup["nDup"] for dup in oNFe.cobr],
+            [
+                tagtext(oNode=dup, cTag="nDup")
+                for dup in self._find(self.infNFe, "cobr")
+            ],
+        )
+
+        dets = self.infNFe.findall("{%s}det" % NFE_NS)
+        self.assertEqual(len(oNFe.items), len(dets))
+        for item, det in zip(oNFe.items, dets):
+            for cTag in ITEM_TAGS:
+                self.assertEqual(getattr(item, cTag), tagtext(oNode=det, cTag=cTag))
+            icms = self._find(det, "ICMS")
+            for cTag in ("orig", "CST", "vBC", "vICMS", "pICMS"):
+                self.assertEqual(getattr(item, cTag), tagtext(oNode=icms, cTag=cTag))
+            ipi = self._find(det, "IPI")
+            for cTag in ("vIPI", "pIPI"):
+                self.assertEqual(getattr(item, cTag), tagtext(oNode=ipi, cTag=cTag))
+
+    def test_stream_same_as_tree(self):
+        oNFe = NFeData(self.root)
+        stream = NFeStream(self.xml)
+        self.assertEqual(
+            [self._item_values(item) for item in stream.iter_items()],
+            [self._item_values(item) for item in oNFe.items],
+        )
+        self.assertEqual(stream.data.chave, oNFe.chave)
+        self.assertEqual(stream.data.ide["nNF"], oNFe.ide["nNF"])
+        self.assertEqual(stream.data.prot["nProt"], oNFe.prot["nProt"])
+        self.assertFalse(stream.data.items)
+
+    def test_send_xml(self):
+        # XML de envio, colocado em um nfeProc sem protocolo
+        xml = etree.tostring(self._find(self.root, "NFe"))
+        root = parse_nfe(xml)
+        self.assertEqual(etree.QName(root).localname, "nfeProc")
+        oNFe = NFeData(root)
+        self.assertEqual(oNFe.chave, NFE_KEY)
+        self.assertEqual(len(oNFe.items), 3)
+        self.assertEqual(oNFe.prot["nProt"], "")
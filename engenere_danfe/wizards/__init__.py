@@ -0,0 +1 @@
+from . import danfe_export_wizard
@@ -0,0 +1,71 @@
+# Copyright 2023 Engenere.one
+# License AGPL-3.0 or later (https://www.gnu.org/licenses/agpl).
+
+from datetime import datetime, time, timedelta
+
+import pytz
+
+from odoo import _, api, fields, models
+from odoo.exceptions import UserError, ValidationError
+
+
+class DanfeExportWizard(models.TransientModel):
+
+    _name = "engenere_danfe.export.wizard"
+    _description = "Export DANFEs and XMLs"
+
+    company_id = fields.Many2one(
+        "res.company",
+        string="Company",
+        required=True,
+        default=lambda self: self.env.company,
+    )
+
+    date_start = fields.Date("Start Date", required=True)
+
+    date_end = fields.Date("End Date", required=True)
+
+    @api.constrains("date_start", "date_end")
+    def _check_dates(self):
+        for wizard in self:
+            if wizard.date_start > wizard.date_end:
+                raise ValidationError(_("The start date must be before the end date."))
+
+    def _get_day_start(self, date):
+        """Início do dia no timezone do usuário (ou da empresa), em UTC como
+        o document_date."""
+        tz = pytz.timezone(
+            self.env.context.get("tz")
+            or self.env.user.tz
+            or self.company_id.partner_id.tz
+            or "UTC"
+        )
+        day_start = tz.localize(datetime.combine(date, time.min))
+        return day_start.astimezone(pytz.utc).replace(tzinfo=None)
+
+    def _get_export_domain(self):
+        self.ensure_one()
+        return self.env["l10n_br_fiscal.document"]._get_danfe_export_domain(
+            self.company_id,
+            self._get_day_start(self.date_start),
+            self._get_day_start(self.date_end + timedelta(days=1)),
+        )
+
+    def _get_export_filename(self):
+        self.ensure_one()
+        return "danfe_%s_%s.zip" % (
+            self.date_start.strftime("%Y%m%d"),
+            self.date_end.strftime("%Y%m%d"),
+        )
+
+    def action_export(self):
+        self.ensure_one()
+        if not self.env["l10n_br_fiscal.document"].search_count(
+            self._get_export_domain()
+        ):
+            raise UserError(_("No authorized NF-e was found in this period."))
+        return {
+            "type": "ir.actions.act_url",
+            "url": "/engenere_danfe/export/%s" % self.id,
+            "target": "self",
+        }
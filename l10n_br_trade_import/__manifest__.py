@@ -10,7 +10,7 @@
     "author": "Engenere," "Odoo Community Association (OCA)",
     "maintainers": ["antoniospneto", "felipemotter"],
     "website": "https://engenere.one",
-    "version": "14.0.0.0.0",
+    "version": "14.0.1.0.0",
     "development_status": "Beta",
     "depends": [
         "l10n_br_nfe",
@@ -25,6 +25,7 @@
         "views/nfe_adi_view.xml",
         "views/nfe_di_view.xml",
         "views/nfe_document_view.xml",
+        "wizards/di_import_wizard.xml",
     ],
     "installable": True,
 }
@@ -0,0 +1,74 @@
+# Copyright (C) 2023-Today - Engenere (<https://engenere.one>).
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+import logging
+
+_logger = logging.getLogger(__name__)
+
+
+def _merge_identical_additions(cr):
+    """Additions repeated with exactly the same data are merged into the
+    oldest one, keeping their links to the invoice lines."""
+    cr.execute(
+        """
+        SELECT MIN(id), ARRAY_AGG(id ORDER BY id)
+        FROM l10n_br_trade_import_addition
+        GROUP BY import_declaration_id, addition_number, addtion_sequence,
+            manufacturer_id, discount_value, drawback
+        HAVING COUNT(*) > 1
+        """
+    )
+    for keep_id, ids in cr.fetchall():
+        duplicate_ids = tuple(ids[1:])
+        cr.execute(
+            """
+            INSERT INTO l10n_br_account_import_addition_move_line_rel
+                (move_line_id, import_addition_id)
+            SELECT move_line_id, %s
+            FROM l10n_br_account_import_addition_move_line_rel
+            WHERE import_addition_id IN %s
+            ON CONFLICT DO NOTHING
+            """,
+            (keep_id, duplicate_ids),
+        )
+        cr.execute(
+            "DELETE FROM l10n_br_trade_import_addition WHERE id IN %s",
+            (duplicate_ids,),
+        )
+        _logger.info(
+            "Import additions %s merged into the identical addition %s",
+            list(duplicate_ids),
+            keep_id,
+        )
+
+
+def _report_duplicated_additions(cr):
+    """Additions with the same number and sequence but different data
+    cannot be merged safely; they are reported so they can be fixed by hand
+    before the unique constraint can be created."""
+    cr.execute(
+        """
+        SELECT import_declaration_id, addition_number, addtion_sequence,
+            ARRAY_AGG(id ORDER BY id)
+        FROM l10n_br_trade_import_addition
+        GROUP BY import_declaration_id, addition_number, addtion_sequence
+        HAVING COUNT(*) > 1
+        """
+    )
+    for declaration_id, number, sequence, ids in cr.fetchall():
+        _logger.error(
+            "Import declaration %s has the additions %s with the same number %s "
+            "and sequence %s. Fix them and update the module again to create "
+            "the addition_sequence_uniq constraint.",
+            declaration_id,
+            ids,
+            number,
+            sequence,
+        )
+
+
+def migrate(cr, version):
+    if not version:
+        return
+    _merge_identical_additions(cr)
+    _report_duplicated_additions(cr)
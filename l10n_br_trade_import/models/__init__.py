@@ -2,3 +2,4 @@ from . import l10n_br_import_declaration
 from . import l10n_br_import_addition
 from . import account_move_line
 from . import fiscal_document_line
+from . import fiscal_document
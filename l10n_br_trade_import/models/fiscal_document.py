@@ -0,0 +1,32 @@
+# Copyright (C) 2023-Today - Engenere (<https://engenere.one>).
+# @author Antônio S. Pereira Neto <neto@engenere.one>
+
+from odoo import models
+
+
+class FiscalDocument(models.Model):
+
+    _inherit = "l10n_br_fiscal.document"
+
+    def _need_compute_nfe_tags_in_state(self, state):
+        """_need_compute_nfe_tags of the document as if it were in the given
+        state, evaluated on a new record so the document isn't changed."""
+        self.ensure_one()
+        return self.new({"state_edoc": state}, origin=self)._need_compute_nfe_tags()
+
+    def _recompute_nfe40_DI_on_state(self, old_state):
+        """DI tags changes are skipped while the document doesn't need the
+        NF-e tags, so they are recomputed when it enters such a state coming
+        from one that doesn't. Other state changes leave them untouched."""
+        documents = self.filtered(
+            lambda doc: doc._need_compute_nfe_tags()
+            and not doc._need_compute_nfe_tags_in_state(old_state)
+        )
+        lines = documents.mapped("fiscal_line_ids")
+        if not lines:
+            return
+        self.env.add_to_compute(lines._fields["nfe40_DI"], lines)
+
+    def _after_change_state(self, old_state, new_state):
+        self._recompute_nfe40_DI_on_state(old_state)
+        return super()._after_change_state(old_state, new_state)
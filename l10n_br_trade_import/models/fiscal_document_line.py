@@ -3,6 +3,41 @@
 
 from odoo import api, fields, models
 
+MAP_INTERMEDIARY_TYPE = {
+    "conta_propria": "1",
+    "conta_ordem": "2",
+    "encomenda": "3",
+}
+
+MAP_TRANSPORTATION_TYPE = {
+    "maritime": "1",
+    "fluvial": "2",
+    "lacustrine": "3",
+    "aerial": "4",
+    "postal": "5",
+    "rail": "6",
+    "road": "7",
+    "conduit": "8",
+    "own_means": "9",
+    "fict_in_out": "10",
+    "courier": "11",
+    "in_hands": "12",
+    "towing": "13",
+}
+
+
+def _changed_values(record, vals):
+    """Only the values that differ from the ones already stored in record,
+    compared after the conversion made by each field."""
+    changed = {}
+    for fname, value in vals.items():
+        field = record._fields[fname]
+        if field.convert_to_cache(value, record) != field.convert_to_cache(
+            record[fname], record
+        ):
+            changed[fname] = value
+    return changed
+
 
 class FiscalDocumentLine(models.Model):
 
@@ -19,73 +54,169 @@ class FiscalDocumentLine(models.Model):
         store=True,
     )
 
-    @api.depends("account_line_ids.import_addition_ids", "document_id.state_edoc")
-    def _compute_nfe40_DI(self):
-        for line in self:
-            if line.document_id._need_compute_nfe_tags:
-                import_declarations = line.account_line_ids.import_addition_ids.mapped(
-                    "import_declaration_id"
-                )
+    def _prepare_nfe40_DI_values(self, di):
+        return {
+            "nfe40_nDI": di.document_number,
+            "nfe40_dDI": di.document_date,
+            "nfe40_xLocDesemb": di.customs_clearance_location,
+            "nfe40_UFDesemb": di.customs_clearance_state_id.code,
+            "nfe40_dDesemb": di.customs_clearance_date,
+            "nfe40_tpViaTransp": MAP_TRANSPORTATION_TYPE[di.transportation_type],
+            "nfe40_vAFRMM": di.afrmm_value,
+            "nfe40_tpIntermedio": MAP_INTERMEDIARY_TYPE[di.intermediary_type],
+            "nfe40_CNPJ": di.third_party_partner_id.cnpj_cpf,
+            "nfe40_UFTerceiro": di.third_party_partner_id.state_id.code,
+            "nfe40_cExportador": di.exporting_partner_id.id,
+        }
+
+    def _prepare_nfe40_adi_values(self, addition):
+        return {
+            "nfe40_nAdicao": addition.addition_number,
+            "nfe40_nSeqAdic": addition.addtion_sequence,
+            "nfe40_cFabricante": addition.manufacturer_id.id,
+            "nfe40_vDescDI": addition.discount_value,
+            "nfe40_nDraw": addition.drawback,
+        }
+
+    def _get_nfe40_adi_commands(self, nfe_di, list_adi_vals):
+        """Commands that bring the additions of an existing nfe40_DI in line
+        with the import additions, matched by (number, sequence)."""
+        existing = {}
+        for nfe_adi in nfe_di.nfe40_adi:
+            key = (nfe_adi.nfe40_nAdicao, str(nfe_adi.nfe40_nSeqAdic))
+            existing.setdefault(key, []).append(nfe_adi)
+
+        commands = []
+        for adi_vals in list_adi_vals:
+            key = (adi_vals["nfe40_nAdicao"], str(adi_vals["nfe40_nSeqAdic"]))
+            matches = existing.get(key)
+            if not matches:
+                commands.append((0, 0, dict(adi_vals)))
+                continue
+            nfe_adi = matches.pop(0)
+            changed = _changed_values(nfe_adi, adi_vals)
+            if changed:
+                commands.append((1, nfe_adi.id, changed))
+
+        for matches in existing.values():
+            commands.extend((2, nfe_adi.id, 0) for nfe_adi in matches)
+        return commands
+
+    def _get_nfe40_DI_commands(self, di_vals_by_id, adi_vals_by_id):
+        """Commands that bring nfe40_DI in line with the import additions of
+        the line. DIs are matched by number and only the differences are
+        written, so recomputing an unchanged line writes nothing.
 
-                map_intermediary_type = {
-                    "conta_propria": "1",
-                    "conta_ordem": "2",
-                    "encomenda": "3",
-                }
-
-                map_transportation_type = {
-                    "maritime": "1",
-                    "fluvial": "2",
-                    "lacustrine": "3",
-                    "aerial": "4",
-                    "postal": "5",
-                    "rail": "6",
-                    "road": "7",
-                    "conduit": "8",
-                    "own_means": "9",
-                    "fict_in_out": "10",
-                    "courier": "11",
-                    "in_hands": "12",
-                    "towing": "13",
-                }
-
-                for di in import_declarations:
-                    addition = di.addition_ids.filtered(
-                        lambda a: a in line.account_line_ids.import_addition_ids
+        :param di_vals_by_id: nfe40_DI values of each import declaration id
+        :param adi_vals_by_id: nfe40_adi values of each import addition id
+        """
+        self.ensure_one()
+        return self._get_nfe40_DI_diff_commands(
+            self.nfe40_DI,
+            self.account_line_ids.import_addition_ids,
+            di_vals_by_id,
+            adi_vals_by_id,
+        )
+
+    @api.model
+    def _get_nfe40_DI_diff_commands(
+        self, nfe_dis, additions, di_vals_by_id, adi_vals_by_id
+    ):
+        """Commands that turn the nfe.40.di records nfe_dis into the DI tags
+        of the import additions."""
+        # Additions grouped by declaration, in the order of di.addition_ids
+        additions_by_di = {}
+        for addition in additions:
+            additions_by_di.setdefault(addition.import_declaration_id.id, []).append(
+                addition.id
+            )
+
+        existing = {}
+        for nfe_di in nfe_dis:
+            existing.setdefault(nfe_di.nfe40_nDI, []).append(nfe_di)
+
+        commands = []
+        for di_id, addition_ids in additions_by_di.items():
+            di_vals = di_vals_by_id[di_id]
+            list_adi_vals = [adi_vals_by_id[a_id] for a_id in sorted(addition_ids)]
+            matches = existing.get(di_vals["nfe40_nDI"])
+            if not matches:
+                commands.append(
+                    (
+                        0,
+                        0,
+                        dict(
+                            di_vals,
+                            nfe40_adi=[(0, 0, dict(vals)) for vals in list_adi_vals],
+                        ),
                     )
+                )
+                continue
+
+            nfe_di = matches.pop(0)
+            changed = _changed_values(nfe_di, di_vals)
+            adi_commands = self._get_nfe40_adi_commands(nfe_di, list_adi_vals)
+            if adi_commands:
+                changed["nfe40_adi"] = adi_commands
+            if changed:
+                commands.append((1, nfe_di.id, changed))
+
+        for matches in existing.values():
+            commands.extend((2, nfe_di.id, 0) for nfe_di in matches)
+        return commands
+
+    # Only the data that goes into the tags. The document entering a state
+    # that needs the NF-e tags is handled in l10n_br_fiscal.document
+    @api.depends(
+        "account_line_ids.import_addition_ids",
+        "account_line_ids.import_addition_ids.addition_number",
+        "account_line_ids.import_addition_ids.addtion_sequence",
+        "account_line_ids.import_addition_ids.manufacturer_id",
+        "account_line_ids.import_addition_ids.discount_value",
+        "account_line_ids.import_addition_ids.drawback",
+        "account_line_ids.import_addition_ids.import_declaration_id",
+        "account_line_ids.import_addition_ids.import_declaration_id.document_number",
+        "account_line_ids.import_addition_ids.import_declaration_id.document_date",
+        "account_line_ids.import_addition_ids.import_declaration_id."
+        "customs_clearance_location",
+        "account_line_ids.import_addition_ids.import_declaration_id."
+        "customs_clearance_state_id.code",
+        "account_line_ids.import_addition_ids.import_declaration_id."
+        "customs_clearance_date",
+        "account_line_ids.import_addition_ids.import_declaration_id."
+        "transportation_type",
+        "account_line_ids.import_addition_ids.import_declaration_id.afrmm_value",
+        "account_line_ids.import_addition_ids.import_declaration_id."
+        "intermediary_type",
+        "account_line_ids.import_addition_ids.import_declaration_id."
+        "third_party_partner_id.cnpj_cpf",
+        "account_line_ids.import_addition_ids.import_declaration_id."
+        "third_party_partner_id.state_id.code",
+        "account_line_ids.import_addition_ids.import_declaration_id."
+        "exporting_partner_id",
+    )
+    def _compute_nfe40_DI(self):
+        lines = self.filtered(lambda line: line.document_id._need_compute_nfe_tags())
+        if not lines:
+            return
+
+        # Additions, declarations and their partners are read once for all
+        # the lines, and the values of each DI and addition built only once
+        additions = lines.mapped("account_line_ids.import_addition_ids")
+        declarations = additions.mapped("import_declaration_id")
+        declarations.mapped("customs_clearance_state_id.code")
+        declarations.mapped("third_party_partner_id.state_id.code")
+        di_vals_by_id = {
+            di.id: self._prepare_nfe40_DI_values(di) for di in declarations
+        }
+        adi_vals_by_id = {
+            addition.id: self._prepare_nfe40_adi_values(addition)
+            for addition in additions
+        }
+        # Existing tags of all the lines
+        lines.mapped("nfe40_DI.nfe40_adi")
 
-                    # Prepare the nfe40_nAdicao dicts
-                    nfe40_nAdicao_dicts = []
-                    for add in addition:
-                        nfe40_nAdicao_dict = {
-                            "nfe40_nAdicao": add.addition_number,
-                            "nfe40_nSeqAdic": add.addtion_sequence,
-                            "nfe40_cFabricante": add.manufacturer_id.id,
-                            "nfe40_vDescDI": add.discount_value,
-                            "nfe40_nDraw": add.drawback,
-                        }
-                        nfe40_nAdicao_dicts.append((0, 0, nfe40_nAdicao_dict))
-
-                    # Prepare the nfe40_DI dict
-                    nfe40_DI_dict = {
-                        "nfe40_DI_prod_id": line.id,
-                        "nfe40_nDI": di.document_number,
-                        "nfe40_dDI": di.document_date,
-                        "nfe40_xLocDesemb": di.customs_clearance_location,
-                        "nfe40_UFDesemb": di.customs_clearance_state_id.code,
-                        "nfe40_dDesemb": di.customs_clearance_date,
-                        "nfe40_tpViaTransp": map_transportation_type[
-                            di.transportation_type
-                        ],
-                        "nfe40_vAFRMM": di.afrmm_value,
-                        "nfe40_tpIntermedio": map_intermediary_type[
-                            di.intermediary_type
-                        ],
-                        "nfe40_CNPJ": di.third_party_partner_id.cnpj_cpf,
-                        "nfe40_UFTerceiro": di.third_party_partner_id.state_id.code,
-                        "nfe40_cExportador": di.exporting_partner_id.id,
-                        "nfe40_adi": nfe40_nAdicao_dicts,  # Link to the nfe40_nAdicao records
-                    }
-
-                    line.nfe40_DI = [(2, d, 0) for d in line.nfe40_DI.ids]
-                    line.nfe40_DI = [(0, 0, nfe40_DI_dict)]
+        for line in lines:
+            commands = line._get_nfe40_DI_commands(di_vals_by_id, adi_vals_by_id)
+            if commands:
+                line.nfe40_DI = commands
@@ -8,6 +8,14 @@ class ImportAddition(models.Model):
     _name = "l10n_br_trade_import.addition"
     _description = "Import Addition"
 
+    _sql_constraints = [
+        (
+            "addition_sequence_uniq",
+            "unique(import_declaration_id, addition_number, addtion_sequence)",
+            "The addition number and sequence must be unique per Import Declaration!",
+        )
+    ]
+
     import_declaration_id = fields.Many2one(
         comodel_name="l10n_br_trade_import.declaration",
         string="Import Declaration",
@@ -17,12 +25,16 @@ class ImportAddition(models.Model):
     import_declaration_number = fields.Char(
         string="DI Number",
         related="import_declaration_id.document_number",
+        store=True,
+        index=True,
         help="Number of Import Declaration",
     )
 
     import_declaration_date = fields.Date(
         string="DI Date",
         related="import_declaration_id.document_date",
+        store=True,
+        index=True,
         help="Date of Import Declaration",
     )
 
@@ -0,0 +1,2 @@
+from . import test_di_import_wizard
+from . import test_nfe40_di_commands
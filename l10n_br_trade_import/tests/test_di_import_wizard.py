@@ -0,0 +1,138 @@
+# Copyright (C) 2023-Today - Engenere (<https://engenere.one>).
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+import os
+import tempfile
+from datetime import date
+
+from odoo.tests.common import TransactionCase
+from odoo.tools import file_open
+
+
+class TestDIImportWizard(TransactionCase):
+    def setUp(self):
+        super().setUp()
+        self.declaration_model = self.env["l10n_br_trade_import.declaration"]
+        self.state_sp = self.env.ref("base.state_br_sp")
+        self.state_sc = self.env.ref("base.state_br_sc")
+
+    def _import(self, name, xml):
+        attachment = self.env["ir.attachment"].create({"name": name, "raw": xml})
+        wizard = self.env["l10n_br_trade_import.di.import.wizard"].create(
+            {
+                "attachment_ids": [(6, 0, attachment.ids)],
+                "customs_clearance_state_id": self.state_sc.id,
+            }
+        )
+        wizard.action_import()
+        return wizard
+
+    def test_import(self):
+        germany = self.env.ref("base.de")
+        usa = self.env.ref("base.us")
+        partner_model = self.env["res.partner"]
+        acme_gmbh = partner_model.create(
+            {"name": "Acme GmbH", "is_company": True, "country_id": germany.id}
+        )
+        # Homonyms that must not be linked: a contact of the manufacturer, a
+        # person and a company from another country
+        partner_model.create({"name": "Acme GmbH", "parent_id": acme_gmbh.id})
+        partner_model.create({"name": "Acme Export", "country_id": usa.id})
+        acme_export_br = partner_model.create(
+            {
+                "name": "Acme Export",
+                "is_company": True,
+                "country_id": self.env.ref("base.br").id,
+            }
+        )
+
+        with file_open("l10n_br_trade_import/tests/data/di_siscomex.xml", "rb") as f:
+            wizard = self._import("di_siscomex.xml", f.read())
+
+        self.assertEqual(wizard.state, "done")
+        self.assertEqual(
+            sorted(wizard.declaration_ids.mapped("document_number")),
+            ["2300001", "2300004"],
+        )
+
+        di = wizard.declaration_ids.filtered(lambda d: d.document_number == "2300001")
+        self.assertEqual(di.document_date, date(2023, 5, 10))
+        self.assertEqual(di.customs_clearance_date, date(2023, 5, 12))
+        self.assertEqual(di.customs_clearance_location, "PORTO DE SANTOS")
+        self.assertEqual(di.customs_clearance_state_id, self.state_sp)
+        self.assertEqual(di.transportation_type, "maritime")
+        self.assertAlmostEqual(di.afrmm_value, 123.45)
+        self.assertEqual(di.intermediary_type, "conta_propria")
+        # Created in the country of the acquisition, the Brazilian homonym
+        # is not used
+        exporter = di.exporting_partner_id
+        self.assertEqual(exporter.name, "Acme Export")
+        self.assertNotEqual(exporter, acme_export_br)
+        self.assertTrue(exporter.is_company)
+        self.assertEqual(exporter.country_id, usa)
+        self.assertEqual(
+            [
+                (a.addition_number, a.addtion_sequence, a.manufacturer_id)
+                for a in di.addition_ids.sorted("id")
+            ],
+            [
+                ("001", 1, acme_gmbh),
+                ("001", 2, acme_gmbh),
+                # No manufacturer, the supplier is used
+                ("002", 1, exporter),
+            ],
+        )
+
+        # The default state of the wizard and the partners of the first DI
+        # are used
+        di = wizard.declaration_ids - di
+        self.assertEqual(di.customs_clearance_state_id, self.state_sc)
+        self.assertEqual(di.transportation_type, "aerial")
+        self.assertEqual(di.exporting_partner_id, exporter)
+        self.assertEqual(di.addition_ids.manufacturer_id, acme_gmbh)
+        self.assertEqual(
+            partner_model.search_count([("name", "in", ["Acme GmbH", "Acme Export"])]),
+            5,
+        )
+
+        self.assertIn(
+            "2 declarations and 4 additions imported, 3 skipped", wizard.result
+        )
+        self.assertIn("DI 2300002: invalid item sequence", wizard.result)
+        self.assertIn(
+            "DI 2300003: maritime transport without AFRMM value", wizard.result
+        )
+        self.assertIn("DI 2300001: already imported", wizard.result)
+
+        # Importing the file again skips every DI
+        with file_open("l10n_br_trade_import/tests/data/di_siscomex.xml", "rb") as f:
+            wizard = self._import("di_siscomex.xml", f.read())
+        self.assertFalse(wizard.declaration_ids)
+        self.assertIn(
+            "0 declarations and 0 additions imported, 5 skipped", wizard.result
+        )
+
+    def test_external_entities_not_resolved(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
+            f.write("SECRET")
+        self.addCleanup(os.unlink, f.name)
+        xml = (
+            '<?xml version="1.0"?>'
+            '<!DOCTYPE ListaDeclaracoes [<!ENTITY e SYSTEM "file://%s">]>'
+            "<ListaDeclaracoes><declaracaoImportacao>"
+            "<numeroDI>2300009</numeroDI><dataRegistro>20230510</dataRegistro>"
+            "<dataDesembaraco>20230512</dataDesembaraco>"
+            "<urfDespachoNome>&e;</urfDespachoNome>"
+            "<viaTransporteCodigo>04</viaTransporteCodigo>"
+            "<adicao><numeroAdicao>001</numeroAdicao>"
+            "<fabricanteNome>Acme GmbH</fabricanteNome></adicao>"
+            "</declaracaoImportacao></ListaDeclaracoes>" % f.name
+        )
+        wizard = self._import("entity.xml", xml.encode())
+        self.assertFalse(wizard.declaration_ids)
+        self.assertNotIn("SECRET", wizard.result)
+        self.assertFalse(
+            self.declaration_model.search(
+                [("customs_clearance_location", "ilike", "SECRET")]
+            )
+        )
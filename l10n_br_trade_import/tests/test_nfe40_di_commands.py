@@ -0,0 +1,135 @@
+# Copyright (C) 2023-Today - Engenere (<https://engenere.one>).
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+from datetime import date
+
+from odoo.tests.common import TransactionCase
+
+
+class TestNfe40DICommands(TransactionCase):
+    def setUp(self):
+        super().setUp()
+        self.line_model = self.env["l10n_br_fiscal.document.line"]
+        self.manufacturer = self.env["res.partner"].create({"name": "Manufacturer"})
+        self.exporter = self.env["res.partner"].create({"name": "Exporter"})
+        self.di_1 = self._create_declaration("2300001", ["001", "002"])
+        self.di_2 = self._create_declaration("2300002", ["001"])
+        self.additions = self.di_1.addition_ids | self.di_2.addition_ids
+
+    def _create_declaration(self, number, addition_numbers):
+        return self.env["l10n_br_trade_import.declaration"].create(
+            {
+                "document_number": number,
+                "document_date": date(2023, 5, 10),
+                "customs_clearance_location": "Santos",
+                "customs_clearance_state_id": self.env.ref("base.state_br_sp").id,
+                "customs_clearance_date": date(2023, 5, 12),
+                "transportation_type": "maritime",
+                "afrmm_value": 10.0,
+                "intermediary_type": "conta_propria",
+                "exporting_partner_id": self.exporter.id,
+                "addition_ids": [
+                    (
+                        0,
+                        0,
+                        {
+                            "addition_number": addition_number,
+                            "addtion_sequence": 1,
+                            "manufacturer_id": self.manufacturer.id,
+                        },
+                    )
+                    for addition_number in addition_numbers
+                ],
+            }
+        )
+
+    def _get_commands(self, nfe_dis, additions):
+        declarations = additions.mapped("import_declaration_id")
+        di_vals_by_id = {
+            di.id: self.line_model._prepare_nfe40_DI_values(di) for di in declarations
+        }
+        adi_vals_by_id = {
+            addition.id: self.line_model._prepare_nfe40_adi_values(addition)
+            for addition in additions
+        }
+        return self.line_model._get_nfe40_DI_diff_commands(
+            nfe_dis, additions, di_vals_by_id, adi_vals_by_id
+        )
+
+    def _create_nfe_dis(self):
+        """DI tags as created for a line without them"""
+        commands = self._get_commands(self.env["nfe.40.di"], self.additions)
+        return self.env["nfe.40.di"].create([vals for _c, _id, vals in commands])
+
+    def _get_nfe_di(self, nfe_dis, declaration):
+        return nfe_dis.filtered(lambda d: d.nfe40_nDI == declaration.document_number)
+
+    def test_new_line_gets_all_declarations(self):
+        commands = self._get_commands(self.env["nfe.40.di"], self.additions)
+        self.assertEqual([command[0] for command in commands], [0, 0])
+        adi_count_by_di = {
+            vals["nfe40_nDI"]: len(vals["nfe40_adi"]) for _c, _id, vals in commands
+        }
+        self.assertEqual(adi_count_by_di, {"2300001": 2, "2300002": 1})
+
+    def test_unchanged_writes_nothing(self):
+        nfe_dis = self._create_nfe_dis()
+        self.assertEqual(len(nfe_dis), 2)
+        self.assertEqual(self._get_commands(nfe_dis, self.additions), [])
+
+    def test_changed_field(self):
+        nfe_dis = self._create_nfe_dis()
+        self.di_1.customs_clearance_location = "Paranaguá"
+        self.assertEqual(
+            self._get_commands(nfe_dis, self.additions),
+            [
+                (
+                    1,
+                    self._get_nfe_di(nfe_dis, self.di_1).id,
+                    {"nfe40_xLocDesemb": "Paranaguá"},
+                )
+            ],
+        )
+
+    def test_added_addition(self):
+        nfe_dis = self._create_nfe_dis()
+        addition = self.env["l10n_br_trade_import.addition"].create(
+            {
+                "import_declaration_id": self.di_2.id,
+                "addition_number": "002",
+                "addtion_sequence": 1,
+                "manufacturer_id": self.manufacturer.id,
+            }
+        )
+        commands = self._get_commands(nfe_dis, self.additions | addition)
+        self.assertEqual(
+            commands,
+            [
+                (
+                    1,
+                    self._get_nfe_di(nfe_dis, self.di_2).id,
+                    {
+                        "nfe40_adi": [
+                            (0, 0, self.line_model._prepare_nfe40_adi_values(addition))
+                        ]
+                    },
+                )
+            ],
+        )
+
+    def test_removed_addition(self):
+        nfe_dis = self._create_nfe_dis()
+        nfe_di_1 = self._get_nfe_di(nfe_dis, self.di_1)
+        removed = self.di_1.addition_ids[-1]
+        nfe_adi = nfe_di_1.nfe40_adi.filtered(
+            lambda adi: adi.nfe40_nAdicao == removed.addition_number
+        )
+        commands = self._get_commands(nfe_dis, self.additions - removed)
+        self.assertEqual(
+            commands, [(1, nfe_di_1.id, {"nfe40_adi": [(2, nfe_adi.id, 0)]})]
+        )
+
+    def test_removed_declaration(self):
+        nfe_dis = self._create_nfe_dis()
+        commands = self._get_commands(nfe_dis, self.di_1.addition_ids)
+        self.assertEqual(commands, [(2, self._get_nfe_di(nfe_dis, self.di_2).id, 0)])
@@ -0,0 +1 @@
+from . import di_import_wizard
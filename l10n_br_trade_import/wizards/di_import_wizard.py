@@ -0,0 +1,471 @@
+# Copyright (C) 2023-Today - Engenere (<https://engenere.one>).
+# License AGPL-3.0 or later (http://www.gnu.org/licenses/agpl).
+
+import logging
+from datetime import datetime
+from io import BytesIO
+
+from lxml import etree
+
+from odoo import _, api, fields, models
+from odoo.exceptions import UserError
+
+from ..models.fiscal_document_line import MAP_TRANSPORTATION_TYPE
+
+_logger = logging.getLogger(__name__)
+
+# Siscomex transport route code (viaTransporteCodigo) -> transportation_type
+MAP_TRANSPORTATION_CODE = {
+    int(code): transportation_type
+    for transportation_type, code in MAP_TRANSPORTATION_TYPE.items()
+}
+
+# Declarations created by each create() call
+DI_BATCH_SIZE = 50
+
+
+def _child_text(el, name):
+    """Text of the first child of el with this local name."""
+    child = el.find("{*}%s" % name)
+    if child is None or not child.text:
+        return ""
+    return child.text.strip()
+
+
+def _parse_date(value):
+    """Siscomex dates are YYYYMMDD."""
+    if not value:
+        return False
+    try:
+        return datetime.strptime(value[:8], "%Y%m%d").date()
+    except ValueError:
+        return False
+
+
+def _parse_int(value, default=None):
+    """Integer value of a code, default when it is empty or not a number."""
+    try:
+        return int(value) if value else default
+    except ValueError:
+        return None
+
+
+def _parse_amount(value):
+    """Siscomex amounts are zero-padded integers with 2 implied decimals."""
+    if not value:
+        return 0.0
+    try:
+        return int(value) / 100.0
+    except ValueError:
+        return 0.0
+
+
+def _partner_key(el, name_tag, country_tag):
+    """(name, Siscomex country code) of a partner of the addition, None
+    when the name is missing."""
+    name = _child_text(el, name_tag)
+    if not name:
+        return None
+    return name, _parse_int(_child_text(el, country_tag))
+
+
+def parse_declaration(el):
+    """Values of a declaracaoImportacao element of a Siscomex extract.
+
+    Partners are kept as (name, country code) and the state as its code,
+    they are resolved in batch by the wizard.
+    """
+    additions = []
+    exporter = None
+    for adicao in el.iterfind("{*}adicao"):
+        supplier = _partner_key(
+            adicao, "fornecedorNome", "paisAquisicaoMercadoriaCodigo"
+        )
+        exporter = exporter or supplier
+        values = {
+            "addition_number": _child_text(adicao, "numeroAdicao"),
+            "manufacturer": _partner_key(
+                adicao, "fabricanteNome", "paisOrigemMercadoriaCodigo"
+            )
+            or supplier,
+        }
+        # One addition record for each item of the addition
+        sequences = [
+            _child_text(mercadoria, "numeroSequencialItem")
+            for mercadoria in adicao.iterfind("{*}mercadoria")
+        ]
+        # Invalid sequences are kept as None, the DI is skipped
+        for sequence in sequences or ["1"]:
+            additions.append(
+                dict(values, addtion_sequence=_parse_int(sequence, default=1))
+            )
+
+    return {
+        "document_number": _child_text(el, "numeroDI"),
+        "document_date": _parse_date(_child_text(el, "dataRegistro")),
+        "customs_clearance_location": _child_text(el, "urfDespachoNome"),
+        "customs_clearance_state": _child_text(el, "ufDesembaraco"),
+        "customs_clearance_date": _parse_date(_child_text(el, "dataDesembaraco")),
+        "transportation_type": MAP_TRANSPORTATION_CODE.get(
+            _parse_int(_child_text(el, "viaTransporteCodigo"))
+        ),
+        "afrmm_value": _parse_amount(_child_text(el, "valorAFRMM")),
+        "exporter": exporter,
+        "additions": additions,
+    }
+
+
+def iter_declarations(source):
+    """Declarations of a Siscomex XML, read with iterparse. Each
+    declaracaoImportacao is removed from the tree once read, so the memory
+    used does not depend on the number of declarations in the file.
+
+    The file comes from the user: external entities are not resolved and
+    nothing is fetched from the network.
+
+    :param source: file object or path of the XML
+    """
+    context = etree.iterparse(
+        source,
+        events=("end",),
+        tag="{*}declaracaoImportacao",
+        resolve_entities=False,
+        no_network=True,
+    )
+    for _event, el in context:
+        yield parse_declaration(el)
+        el.getparent().remove(el)
+
+
+class DIImportWizard(models.TransientModel):
+
+    _name = "l10n_br_trade_import.di.import.wizard"
+    _description = "Import Declarations from Siscomex XML"
+
+    attachment_ids = fields.Many2many(
+        comodel_name="ir.attachment",
+        string="XML Files",
+        help="DI extracts in the Siscomex XML format",
+    )
+
+    customs_clearance_state_id = fields.Many2one(
+        comodel_name="res.country.state",
+        string="Default Customs Clearance State",
+        domain=[("country_id.code", "=", "BR")],
+        help="Used when the XML does not inform the state of the customs clearance",
+    )
+
+    intermediary_type = fields.Selection(
+        selection=[
+            ("conta_propria", "Conta Própria"),
+            ("conta_ordem", "Conta e Ordem"),
+            ("encomenda", "Encomenda"),
+        ],
+        required=True,
+        default="conta_propria",
+        string="Intermediation",
+    )
+
+    third_party_partner_id = fields.Many2one(
+        comodel_name="res.partner",
+        string="Acquirer or the Orderer",
+    )
+
+    state = fields.Selection(
+        selection=[("draft", "Draft"), ("done", "Done")],
+        default="draft",
+    )
+
+    result = fields.Text(readonly=True)
+
+    declaration_ids = fields.Many2many(
+        comodel_name="l10n_br_trade_import.declaration",
+        string="Imported Declarations",
+        readonly=True,
+    )
+
+    @api.constrains("intermediary_type", "third_party_partner_id")
+    def _check_third_party_partner_id(self):
+        for wizard in self:
+            if (
+                wizard.intermediary_type in ["conta_ordem", "encomenda"]
+                and not wizard.third_party_partner_id
+            ):
+                raise UserError(
+                    _(
+                        "When the intermediation is 'Conta e Ordem' or 'Encomenda' "
+                        "you must provide the Acquirer or Orderer's information"
+                    )
+                )
+
+    def _get_state_index(self):
+        """Brazilian states by code"""
+        states = self.env["res.country.state"].search([("country_id.code", "=", "BR")])
+        return {state.code: state.id for state in states}
+
+    def _get_country_index(self):
+        """Countries by Siscomex code. The bc_code of l10n_br_base is the
+        same BACEN code followed by a check digit."""
+        country_index = {}
+        for country in self.env["res.country"].search([("bc_code", "!=", False)]):
+            code = _parse_int(country.bc_code[:-1])
+            if code is not None:
+                country_index[code] = country.id
+        return country_index
+
+    def _update_partner_index(self, partner_index, country_index, keys):
+        """Add to partner_index the ids of the partners with these
+        (name, country code) keys, creating in a single call the ones that
+        do not exist yet.
+
+        Siscomex doesn't inform the tax id of foreign partners, they are
+        matched by name and country among the commercial partners only, so
+        contacts and homonyms from other countries aren't linked.
+        """
+        keys = {key for key in keys if key and key not in partner_index}
+        if not keys:
+            return
+        partner_by_name_country = {}
+        for partner in self.env["res.partner"].search(
+            [
+                ("is_company", "=", True),
+                ("parent_id", "=", False),
+                ("name", "in", list({name for name, _code in keys})),
+            ],
+            order="id",
+        ):
+            partner_by_name_country.setdefault(
+                (partner.name, partner.country_id.id), partner.id
+            )
+        for key in keys:
+            name, code = key
+            partner_id = partner_by_name_country.get(
+                (name, country_index.get(code, False))
+            )
+            if partner_id:
+                partner_index[key] = partner_id
+        missing = sorted(
+            keys - set(partner_index), key=lambda key: (key[0], key[1] or 0)
+        )
+        if missing:
+            partners = self.env["res.partner"].create(
+                [
+                    {
+                        "name": name,
+                        "is_company": True,
+                        "country_id": country_index.get(code, False),
+                    }
+                    for name, code in missing
+                ]
+            )
+            partner_index.update(zip(missing, partners.ids))
+
+    def _check_declaration(self, di, state_index, existing_numbers):
+        """Reason why the declaration cannot be imported, if any."""
+        if not di["document_number"]:
+            return _("DI without number")
+        if di["document_number"] in existing_numbers:
+            return _("already imported")
+        if not di["document_date"] or not di["customs_clearance_date"]:
+            return _("registration or customs clearance date missing")
+        if not di["customs_clearance_location"]:
+            return _("customs clearance location missing")
+        if (
+            di["customs_clearance_state"] not in state_index
+            and not self.customs_clearance_state_id
+        ):
+            return _("customs clearance state missing")
+        if not di["transportation_type"]:
+            return _("unknown transport route")
+        if di["transportation_type"] == "maritime" and not di["afrmm_value"]:
+            return _("maritime transport without AFRMM value")
+        if not di["additions"]:
+            return _("DI without additions")
+        if not all(
+            addition["addition_number"] and addition["manufacturer"]
+            for addition in di["additions"]
+        ):
+            return _("addition without number or manufacturer")
+        if any(addition["addtion_sequence"] is None for addition in di["additions"]):
+            return _("invalid item sequence")
+        keys = {
+            (addition["addition_number"], addition["addtion_sequence"])
+            for addition in di["additions"]
+        }
+        if len(keys) != len(di["additions"]):
+            return _("repeated addition number and sequence")
+        return False
+
+    def _prepare_declaration_values(self, di, state_index, partner_index):
+        return {
+            "document_number": di["document_number"],
+            "document_date": di["document_date"],
+            "customs_clearance_location": di["customs_clearance_location"],
+            "customs_clearance_state_id": state_index.get(
+                di["customs_clearance_state"], self.customs_clearance_state_id.id
+            ),
+            "customs_clearance_date": di["customs_clearance_date"],
+            "transportation_type": di["transportation_type"],
+            "afrmm_value": di["afrmm_value"],
+            "intermediary_type": self.intermediary_type,
+            "third_party_partner_id": self.third_party_partner_id.id,
+            "exporting_partner_id": partner_index.get(di["exporter"], False),
+        }
+
+    def _create_declarations(self, list_di, state_index, partner_index, country_index):
+        """Create a batch of declarations and all their additions, with one
+        create() call for each model."""
+        self._update_partner_index(
+            partner_index,
+            country_index,
+            [di["exporter"] for di in list_di]
+            + [
+                addition["manufacturer"]
+                for di in list_di
+                for addition in di["additions"]
+            ],
+        )
+        declarations = self.env["l10n_br_trade_import.declaration"].create(
+            [
+                self._prepare_declaration_values(di, state_index, partner_index)
+                for di in list_di
+            ]
+        )
+        self.env["l10n_br_trade_import.addition"].create(
+            [
+                {
+                    "import_declaration_id": declaration.id,
+                    "addition_number": addition["addition_number"],
+                    "addtion_sequence": addition["addtion_sequence"],
+                    "manufacturer_id": partner_index[addition["manufacturer"]],
+                }
+                for declaration, di in zip(declarations, list_di)
+                for addition in di["additions"]
+            ]
+        )
+        return declarations
+
+    def _import_file(self, attachment, list_skipped):
+        """Import the declarations of an XML file in batches of
+        DI_BATCH_SIZE. The lookup indexes are built once per file.
+
+        :return: the created declarations
+        """
+        state_index = self._get_state_index()
+        country_index = self._get_country_index()
+        partner_index = {}
+        existing_numbers = set()
+        declarations = self.env["l10n_br_trade_import.declaration"]
+        Declaration = self.env["l10n_br_trade_import.declaration"]
+
+        def flush(batch):
+            nonlocal declarations
+            # Declarations already imported, by a previous file or run
+            existing_numbers.update(
+                Declaration.search(
+                    [("document_number", "in", [di["document_number"] for di in batch])]
+                ).mapped("document_number")
+            )
+            list_di = []
+            for di in batch:
+                reason = self._check_declaration(di, state_index, existing_numbers)
+                if reason:
+                    list_skipped.append(
+                        "%s: DI %s: %s"
+                        % (attachment.name, di["document_number"] or "?", reason)
+                    )
+                    continue
+                existing_numbers.add(di["document_number"])
+                list_di.append(di)
+            if list_di:
+                declarations |= self._create_declarations(
+                    list_di, state_index, partner_index, country_index
+                )
+            _logger.info(
+                "%s: %s declarations imported, %s skipped",
+                attachment.name,
+                len(declarations),
+                len(list_skipped),
+            )
+
+        batch = []
+        try:
+            # Only the declaration being read is kept in the tree
+            for di in iter_declarations(BytesIO(attachment.raw)):
+                batch.append(di)
+                if len(batch) >= DI_BATCH_SIZE:
+                    flush(batch)
+                    batch = []
+        except etree.XMLSyntaxError as e:
+            raise UserError(
+                _("%(file)s is not a valid XML: %(error)s")
+                % {"file": attachment.name, "error": e}
+            )
+        if batch:
+            flush(batch)
+        return declarations
+
+    def action_import(self):
+        self.ensure_one()
+        if not self.attachment_ids:
+            raise UserError(_("Select the XML files to import."))
+
+        declarations = self.env["l10n_br_trade_import.declaration"]
+        list_skipped = []
+        # Summary of each file, shown to the user at the end of the import
+        result = []
+        for nr, attachment in enumerate(self.attachment_ids, 1):
+            _logger.info(
+                "Importing DIs from %s (%s/%s)",
+                attachment.name,
+                nr,
+                len(self.attachment_ids),
+            )
+            nr_skipped = len(list_skipped)
+            file_declarations = self._import_file(attachment, list_skipped)
+            declarations |= file_declarations
+            result.append(
+                _(
+                    "%(file)s: %(declarations)s declarations and %(additions)s "
+                    "additions imported, %(skipped)s skipped."
+                )
+                % {
+                    "file": attachment.name,
+                    "declarations": len(file_declarations),
+                    "additions": len(file_declarations.addition_ids),
+                    "skipped": len(list_skipped) - nr_skipped,
+                }
+            )
+
+        result.append(
+            _("Total: %(declarations)s declarations and %(additions)s additions.")
+            % {
+                "declarations": len(declarations),
+                "additions": len(declarations.addition_ids),
+            }
+        )
+        if list_skipped:
+            result.append(_("Skipped:"))
+            result.extend(list_skipped)
+        self.write(
+            {
+                "state": "done",
+                "result": "\n".join(result),
+                "declaration_ids": [(6, 0, declarations.ids)],
+            }
+        )
+        return {
+            "type": "ir.actions.act_window",
+            "res_model": self._name,
+            "res_id": self.id,
+            "view_mode": "form",
+            "target": "new",
+        }
+
+    def action_open_declarations(self):
+        self.ensure_one()
+        action = self.env["ir.actions.act_window"]._for_xml_id(
+            "l10n_br_trade_import.action_import_declaration"
+        )
+        action["domain"] = [("id", "in", self.declaration_ids.ids)]
+        return action